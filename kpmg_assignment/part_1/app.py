@@ -1,12 +1,16 @@
 import streamlit as st
+import asyncio
+import gc
 import json
 import io
-from typing import Dict, Any, Optional
+import pandas as pd
+from typing import Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 import os
+from openai import DefaultAsyncHttpxClient
 from langchain_openai import AzureChatOpenAI
 from ocr import DocumentOCRProcessor
-from field_extraction import FieldExtractor
+from field_extraction import FieldExtractor, PROMPT_CACHE_KEY
 
 # Load environment variables
 load_dotenv()
@@ -81,6 +85,19 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def _iter_leaves(d: Dict[str, Any]):
+    """Yield the leaf (non-dict) values of a nested dictionary"""
+    for v in d.values():
+        if isinstance(v, dict):
+            yield from _iter_leaves(v)
+        else:
+            yield v
+
+@st.cache_data(ttl=600)
+def _warnings_df(warning_rows: Tuple[Tuple[str, str, str], ...]) -> pd.DataFrame:
+    """Build the validation warnings table from (field, message, value) rows"""
+    return pd.DataFrame(warning_rows, columns=["Field", "Issue", "Value"])
+
 class StreamlitApp:
     """
     Streamlit application for Israeli National Insurance form extraction
@@ -109,19 +126,11 @@ class StreamlitApp:
             if not doc_endpoint or not doc_api_key:
                 raise ValueError("Missing required environment variables: AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT, AZURE_DOCUMENT_INTELLIGENCE_KEY")
             
-            # Initialize Azure OpenAI
-            self.llm = AzureChatOpenAI(
-                azure_deployment="gpt-4o",
-                api_version="2024-12-01-preview",
-                temperature=0
-            )
-            
-            # Initialize OCR and field extraction processors
+            # Initialize the OCR processor (the field extractor is created per run, see run_pipeline)
             self.ocr_processor = DocumentOCRProcessor(
                 endpoint=doc_endpoint,
                 api_key=doc_api_key
             )
-            self.field_extractor = FieldExtractor(self.llm)
             
             st.session_state.setup_complete = True
             
@@ -129,6 +138,25 @@ class StreamlitApp:
             st.error(f"Error setting up Azure clients: {str(e)}")
             st.session_state.setup_complete = False
     
+    def create_field_extractor(self, http_async_client: DefaultAsyncHttpxClient) -> FieldExtractor:
+        """
+        Create a field extractor whose Azure OpenAI async calls go through the given HTTP client
+        
+        Args:
+            http_async_client: Async HTTP client owned by the caller's event loop
+            
+        Returns:
+            FieldExtractor: Field extractor backed by a new AzureChatOpenAI instance
+        """
+        llm = AzureChatOpenAI(
+            azure_deployment="gpt-4o",
+            api_version="2024-12-01-preview",
+            temperature=0,
+            extra_body={"prompt_cache_key": PROMPT_CACHE_KEY},
+            http_async_client=http_async_client
+        )
+        return FieldExtractor(llm)
+    
     def render_header(self):
         """Render the application header"""
         st.markdown('<h1 class="main-header">📋 Israeli National Insurance Form Extractor</h1>', 
@@ -150,7 +178,7 @@ class StreamlitApp:
         # Instructions
         st.sidebar.header("📝 Instructions")
         st.sidebar.markdown("""
-        1. Upload a PDF or image file
+        1. Upload one or more PDF or image files
         2. Click 'Process Document'
         3. Review the extracted fields
         4. Review the validation report
@@ -165,58 +193,61 @@ class StreamlitApp:
     
     def handle_file_upload(self):
         """Handle file upload and processing"""
-        uploaded_file = st.file_uploader(
-            "Choose a document file",
+        uploaded_files = st.file_uploader(
+            "Choose document files",
             type=['pdf', 'jpg', 'jpeg', 'png', 'tiff'],
-            help="Upload a PDF or image file containing an Israeli National Insurance form"
+            accept_multiple_files=True,
+            help="Upload one or more PDF or image files containing Israeli National Insurance forms"
         )
         
-        if uploaded_file is not None:
+        if uploaded_files:
             # Process button
             if st.button("🚀 Process Document", type="primary", use_container_width=True):
-                return self.process_document(uploaded_file)
+                return self.process_document(uploaded_files)
         
         return None
     
-    def process_document(self, uploaded_file):
-        """Process the uploaded document"""
+    def process_document(self, uploaded_files):
+        """Process the uploaded documents"""
         try:
             # Show progress
             progress_bar = st.progress(0)
             status_text = st.empty()    
             
-            # Step 1: OCR Processing
-            status_text.text("🔍 Extracting text with Azure Document Intelligence...")
-            progress_bar.progress(25)
-            
-            # Read file content
-            file_content = uploaded_file.read()
+            # OCR and field extraction run as a pipeline: fields are extracted for a
+            # document as soon as its OCR completes, while the next document is OCR'd
+            status_text.text("🔍 Extracting text with Azure Document Intelligence and fields with Azure OpenAI...")
+            progress_bar.progress(10)
             
-            # OCR processing
-            ocr_result = self.ocr_processor.extract_text_from_document(
-                file_content, uploaded_file.type
+            ocr_results, extraction_results = asyncio.run(
+                self.run_pipeline(uploaded_files, progress_bar)
             )
             
-            if not ocr_result["success"]:
-                st.error(f"OCR processing failed: {ocr_result.get('error', 'Unknown error')}")
-                return None
+            # Release request buffers held by the OCR calls
+            gc.collect()
             
-            st.session_state.ocr_result = ocr_result
+            for uploaded_file, ocr_result in zip(uploaded_files, ocr_results):
+                if ocr_result is None or not ocr_result["success"]:
+                    error = ocr_result.get('error', 'Unknown error') if ocr_result else 'Not processed'
+                    st.error(f"OCR processing failed for {uploaded_file.name}: {error}")
+                    return None
             
-            # Step 2: Field Extraction
-            status_text.text("🤖 Extracting fields with Azure OpenAI...")
-            progress_bar.progress(60)
+            st.session_state.ocr_result = ocr_results
             
-            # Field extraction
-            extraction_result = self.field_extractor.extract_fields(
-                ocr_result["extracted_text"]
-            )
-            
-            if not extraction_result["success"]:
-                st.error(f"Field extraction failed: {extraction_result.get('error', 'Unknown error')}")
-                return None
+            for uploaded_file, extraction_result in zip(uploaded_files, extraction_results):
+                if not extraction_result["success"]:
+                    st.error(f"Field extraction failed for {uploaded_file.name}: {extraction_result.get('error', 'Unknown error')}")
+                    return None
             
-            st.session_state.extraction_result = extraction_result
+            # Serialize the extracted fields once, instead of on every rerun
+            st.session_state.extraction_result = [
+                (
+                    uploaded_file.name,
+                    extraction_result,
+                    json.dumps(extraction_result["extracted_fields"], indent=2, ensure_ascii=False)
+                )
+                for uploaded_file, extraction_result in zip(uploaded_files, extraction_results)
+            ]
             
             # Complete
             progress_bar.progress(100)
@@ -228,6 +259,60 @@ class StreamlitApp:
             st.error(f"Error processing document: {str(e)}")
             return None
     
+    async def run_pipeline(self, uploaded_files, progress_bar, num_extract_workers: int = 4):
+        """
+        Run OCR and field extraction as a two-stage producer-consumer pipeline
+        
+        Args:
+            uploaded_files: Uploaded documents to process
+            progress_bar: Streamlit progress bar updated as stages complete
+            num_extract_workers: Number of concurrent field extraction workers
+            
+        Returns:
+            Tuple of (OCR results, extraction results), in upload order. OCR stops at the first
+            failed document, leaving the remaining entries as None.
+        """
+        queue = asyncio.Queue()
+        ocr_results = [None] * len(uploaded_files)
+        extraction_results = [None] * len(uploaded_files)
+        total_steps = 2 * len(uploaded_files)
+        completed_steps = 0
+        
+        def advance():
+            nonlocal completed_steps
+            completed_steps += 1
+            progress_bar.progress(10 + int(90 * completed_steps / total_steps))
+        
+        async def ocr_stage():
+            try:
+                for idx, uploaded_file in enumerate(uploaded_files):
+                    ocr_result = await self.ocr_processor.aextract_text_from_document(
+                        uploaded_file, uploaded_file.type
+                    )
+                    ocr_results[idx] = ocr_result
+                    if not ocr_result["success"]:
+                        break
+                    advance()
+                    await queue.put((idx, ocr_result["extracted_text"]))
+            finally:
+                # Signal every extraction worker to stop
+                for _ in range(num_extract_workers):
+                    await queue.put(None)
+        
+        async def extract_stage():
+            while (item := await queue.get()) is not None:
+                idx, ocr_text = item
+                extraction_results[idx] = await field_extractor.aextract_fields(ocr_text)
+                advance()
+        
+        # asyncio.run() creates a new event loop on every click, and async HTTP connections are bound
+        # to the loop that opened them, so the LLM client is created for this run and closed with it
+        # (the OCR processor already opens its async client per document)
+        async with DefaultAsyncHttpxClient() as http_async_client:
+            field_extractor = self.create_field_extractor(http_async_client)
+            await asyncio.gather(ocr_stage(), *[extract_stage() for _ in range(num_extract_workers)])
+        return ocr_results, extraction_results
+    
     def render_results(self, config):
         """Render the processing results"""
         if st.session_state.extraction_result is None:
@@ -239,19 +324,27 @@ class StreamlitApp:
         st.markdown('<div class="success-box">✅ Document processed successfully!</div>', 
                    unsafe_allow_html=True)
         
+        results = st.session_state.extraction_result
+        if len(results) == 1:
+            file_name, extraction_result, json_str = results[0]
+            self.render_document_result(file_name, extraction_result, json_str, key="0")
+            return
+        
+        # One tab per processed document
+        tabs = st.tabs([file_name for file_name, _, _ in results])
+        for i, (tab, (file_name, extraction_result, json_str)) in enumerate(zip(tabs, results)):
+            with tab:
+                self.render_document_result(file_name, extraction_result, json_str, key=str(i))
+    
+    def render_document_result(self, file_name, extraction_result, json_str, key):
+        """Render the extraction result of a single document"""
         # Processing summary
-        extracted_fields = st.session_state.extraction_result["extracted_fields"]
+        extracted_fields = extraction_result["extracted_fields"]
         
         col1, col2, col3 = st.columns(3)
         with col1:
-            # Count fields extracted
-            fields_extracted = sum(1 for k, v in extracted_fields.items() if v != "" and not isinstance(v, dict))
-            # Count extracted nested fields
-            for k, v in extracted_fields.items():
-                if isinstance(v, dict):
-                    for k2, v2 in v.items():
-                        if v2 != "":
-                            fields_extracted += 1
+            # Count fields extracted, including nested fields
+            fields_extracted = sum(1 for v in _iter_leaves(extracted_fields) if v != "")
             st.metric("Fields Extracted", fields_extracted)
         with col2:
             st.metric("Processing Status", "✅ Success")
@@ -261,10 +354,7 @@ class StreamlitApp:
         # Extracted Fields (Main Result)
         st.subheader("📋 Extracted Fields")
         
-        extracted_fields = st.session_state.extraction_result["extracted_fields"]
-        
         # Display as formatted JSON
-        json_str = json.dumps(extracted_fields, indent=2, ensure_ascii=False)
         st.markdown(f'<div class="json-container"><pre>{json_str}</pre></div>', 
                    unsafe_allow_html=True)
         
@@ -272,33 +362,27 @@ class StreamlitApp:
         st.download_button(
             label="⬇️ Download JSON",
             data=json_str,
-            file_name="extracted_fields.json",
+            file_name=f"{os.path.splitext(file_name)[0]}_extracted_fields.json",
             mime="application/json",
-            use_container_width=True
+            use_container_width=True,
+            key=f"download_{key}"
         )
         
         # Validation Report - Always shown
         st.subheader("📋 Validation Report")
-        validation_warnings = st.session_state.extraction_result.get("validation_warnings", [])
+        validation_warnings = extraction_result.get("validation_warnings", [])
         
         if validation_warnings:
             st.markdown('<div class="warning-box">⚠️ Validation warnings detected. Please review the fields below:</div>', 
                        unsafe_allow_html=True)
             
-            # Group warnings by field
-            warning_data = []
-            for warning in validation_warnings:
-                warning_data.append({
-                    "Field": warning["field"],
-                    "Issue": warning["message"],
-                    "Value": warning.get("value", "")
-                })
-            
-            # Display warnings in a table
-            if warning_data:
-                import pandas as pd
-                df_warnings = pd.DataFrame(warning_data)
-                st.dataframe(df_warnings, use_container_width=True)
+            # Display warnings in a table - rows are passed as a hashable key so the
+            # DataFrame is only rebuilt when the warnings change
+            warning_rows = tuple(
+                (warning["field"], warning["message"], warning.get("value", ""))
+                for warning in validation_warnings
+            )
+            st.dataframe(_warnings_df(warning_rows), use_container_width=True)
         else:
             st.markdown('<div class="success-box">✅ All fields passed validation checks</div>', 
                        unsafe_allow_html=True)
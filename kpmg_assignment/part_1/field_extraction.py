@@ -1,14 +1,88 @@
+import asyncio
+import copy
 import json
 import re
-from typing import Dict, Any
+import time
+from typing import Dict, Any, Iterator, List, Tuple
 from langchain_openai import AzureChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
+from langchain.schema import BaseMessage, HumanMessage, SystemMessage
 from pydantic import BaseModel, Field
 import logging
 from ocr import DocumentOCRProcessor
 from dotenv import load_dotenv
 import os
 
+# Quiet the Azure SDK's per-request logging; the root logging setup is left to the entry point
+logging.getLogger('azure').setLevel(logging.WARNING)
+
+# Precompiled validation patterns
+_ID_RE = re.compile(r'^\d{9}$')
+_PHONE_RE = re.compile(r'^[\d\-\s\+\(\)]+$')
+_DIGITS_RE = re.compile(r'^\d+$')
+_MED_CODE_RE = re.compile(r'^[A-Za-z0-9]{4}$')
+
+# Digit characters, for digit checks without running the regex engine
+_DIGIT_CHARS = frozenset("0123456789")
+
+# OCR text preprocessing patterns and limits
+_TRAILING_WS_RE = re.compile(r'\s+\n')
+_RULE_LINE_RE = re.compile(r'^[\s\.\-_]{3,}$')
+_MAX_OCR_CHARS = 8000
+
+# Fields checked by the validation pass
+_DATE_FIELDS = ("dateOfBirth", "dateOfInjury", "formFillingDate", "formReceiptDateAtClinic")
+_PHONE_FIELDS = ("landlinePhone", "mobilePhone")
+_STRING_FIELDS = ("lastName", "firstName", "jobType", "accidentLocation", "accidentDescription", "injuredBodyPart", "signature")
+_ADDRESS_STRING_FIELDS = ("street", "city")
+_ADDRESS_NUMERIC_FIELDS = ("houseNumber", "postalCode")
+_MEDICAL_CODE_FIELDS = ("natureOfAccident", "medicalDiagnoses")
+_VALID_HEALTH_FUNDS = ("כללית", "מאוחדת", "מכבי", "לאומית")
+_VALID_GENDERS = ("זכר", "נקבה")
+
+# Static system prompt, kept byte-identical across calls so it forms a cacheable prompt prefix
+_SYSTEM_PROMPT = """# Identity
+            
+You are an expert at extracting information from Israeli National Insurance Institute (ביטוח לאומי) forms.
+
+# Instructions
+
+Your task is to extract specific fields from the OCR text and return them in valid JSON format. Follow the guidelines below:
+
+<guidelines>
+1. Extract information accurately from both Hebrew and English text
+2. For any field that is not present or cannot be extracted, use an empty string ""
+3. For Signature field, extract the text that is written right under 'חתימה X' or 'חתימהX'. If signature is not present, then leave it empty. \
+    For example, if the text is 'חתימה X\nJames', then the signature should be 'James'. \
+    If the text is 'חתימה X\n5 למילוי ע״י המוסד הרפואי :selected:', then signature does not appear, and the field should be left empty. \
+    Avoid inferring the signature from the text if it is not explicitly present. \
+4. For natureOfAccident and medicalDiagnoses fields, extract the text that is written under 'מהות התאונה (אבחנות רפואיות):', only if that field is selected in the form (:selected: מהות התאונה (אבחנות רפואיות):). \
+    The value of each of the fields should be an 4-character alphanumeric medical diagnosis code (e.g., ICD code). \
+    For example, if the text is ':selected: מהות התאונה (אבחנות רפואיות):\n1234\n5678', then the natureOfAccident field should be '1234' and the medicalDiagnoses field should be '5678'. \
+5. Return ONLY valid JSON that matches the specified schema
+</guidelines>"""
+
+# Cache key grouping extraction requests that share the system prompt prefix
+PROMPT_CACHE_KEY = "israeli_ni_v1"
+
+def _in_range(value: str, low: int, high: int) -> bool:
+    """Check that a string is a number within [low, high]"""
+    return value.isdigit() and low <= int(value) <= high
+
+def _preprocess_ocr(text: str) -> str:
+    """
+    Shrink OCR text before sending it to the LLM: drop blank lines, trailing whitespace
+    and form rule lines, then cap the length by cutting out the middle (the head and
+    tail of the form are kept). Repeated lines are kept, since equal values of different
+    fields and runs of checkbox markers are real data.
+    """
+    lines = _TRAILING_WS_RE.sub('\n', text).split('\n')
+    text = '\n'.join(line for line in lines if not _RULE_LINE_RE.match(line))
+    
+    if len(text) > _MAX_OCR_CHARS:
+        half = _MAX_OCR_CHARS // 2
+        text = f"{text[:half]}\n...\n{text[-half:]}"
+    return text
+
 # Pydantic models for structured output
 class DateInfo(BaseModel):
     """Date information with day, month, year"""
@@ -38,21 +112,65 @@ class ExtractedFields(BaseModel):
     firstName: str = Field(default="", description="First name / שם פרטי")
     idNumber: str = Field(default="", description="ID number / מספר זהות")
     gender: str = Field(default="", description="Gender / מין")
-    dateOfBirth: DateInfo = Field(default_factory=DateInfo, description="Date of birth / תאריך לידה")
-    address: Address = Field(default_factory=Address, description="Address / כתובת")
+    dateOfBirth: DateInfo = Field(default_factory=DateInfo.model_construct, description="Date of birth / תאריך לידה")
+    address: Address = Field(default_factory=Address.model_construct, description="Address / כתובת")
     landlinePhone: str = Field(default="", description="Landline phone / טלפון קווי")
     mobilePhone: str = Field(default="", description="Mobile phone / טלפון נייד")
     jobType: str = Field(default="", description="Job type / סוג העבודה")
-    dateOfInjury: DateInfo = Field(default_factory=DateInfo, description="Date of injury / תאריך הפגיעה")
+    dateOfInjury: DateInfo = Field(default_factory=DateInfo.model_construct, description="Date of injury / תאריך הפגיעה")
     timeOfInjury: str = Field(default="", description="Time of injury / שעת הפגיעה")
     accidentLocation: str = Field(default="", description="Accident location / מקום התאונה")
     accidentAddress: str = Field(default="", description="Accident address / כתובת מקום התאונה")
     accidentDescription: str = Field(default="", description="Accident description / תיאור התאונה")
     injuredBodyPart: str = Field(default="", description="Injured body part / האיבר שנפגע")
     signature: str = Field(default="", description="Signature / חתימה")
-    formFillingDate: DateInfo = Field(default_factory=DateInfo, description="Form filling date / תאריך מילוי הטופס")
-    formReceiptDateAtClinic: DateInfo = Field(default_factory=DateInfo, description="Form receipt date at clinic / תאריך קבלת הטופס בקופה")
-    medicalInstitutionFields: MedicalInstitutionFields = Field(default_factory=MedicalInstitutionFields, description="Medical institution fields / למילוי ע\"י המוסד הרפואי")
+    formFillingDate: DateInfo = Field(default_factory=DateInfo.model_construct, description="Form filling date / תאריך מילוי הטופס")
+    formReceiptDateAtClinic: DateInfo = Field(default_factory=DateInfo.model_construct, description="Form receipt date at clinic / תאריך קבלת הטופס בקופה")
+    medicalInstitutionFields: MedicalInstitutionFields = Field(default_factory=MedicalInstitutionFields.model_construct, description="Medical institution fields / למילוי ע\"י המוסד הרפואי")
+
+# Empty-default extraction result, built once at import time; copy it before handing it out
+_EMPTY_SCHEMA = ExtractedFields().model_dump()
+
+def _to_strict_json_schema(schema: Any) -> Any:
+    """
+    Adapt a Pydantic JSON schema to the subset accepted by OpenAI strict structured outputs
+    (every property required, no additional properties, no defaults)
+    """
+    if isinstance(schema, list):
+        return [_to_strict_json_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    if "$ref" in schema:
+        return {"$ref": schema["$ref"]}
+    if len(schema.get("allOf", [])) == 1:
+        return _to_strict_json_schema(schema["allOf"][0])
+    
+    strict_schema = {}
+    for key, value in schema.items():
+        if key in ("default", "title"):
+            continue
+        if key in ("properties", "$defs"):
+            strict_schema[key] = {name: _to_strict_json_schema(sub_schema) for name, sub_schema in value.items()}
+        else:
+            strict_schema[key] = _to_strict_json_schema(value)
+    
+    if strict_schema.get("type") == "object":
+        strict_schema["additionalProperties"] = False
+        strict_schema["required"] = list(strict_schema.get("properties", {}))
+    return strict_schema
+
+# Native JSON-schema response format, enforced server-side by Azure OpenAI
+_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "ExtractedFields",
+        "schema": _to_strict_json_schema(ExtractedFields.model_json_schema()),
+        "strict": True
+    }
+}
+
+# Batch statuses after which the batch will not progress any further
+_BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
 
 class FieldExtractor:
     """
@@ -68,13 +186,13 @@ class FieldExtractor:
         """
         self.llm = llm
         
-        # Setup logging with reduced verbosity
-        logging.basicConfig(level=logging.WARNING)
-        logging.getLogger('azure').setLevel(logging.WARNING)
+        # LLM constrained to return JSON matching the ExtractedFields schema
+        self.json_llm = llm.bind(response_format=_RESPONSE_FORMAT)
+        
         self.logger = logging.getLogger(__name__)
         
         # Define the expected JSON schema
-        self.target_schema = ExtractedFields().model_dump()
+        self.target_schema = copy.deepcopy(_EMPTY_SCHEMA)
         
         # Initialize validation warnings list
         self.validation_warnings = []
@@ -90,151 +208,255 @@ class FieldExtractor:
             Dictionary containing extracted fields and metadata
         """
         try:
-            # Clear validation warnings for new extraction
-            self.validation_warnings = []
-            
-            # Create LLM with structured output
-            structured_llm = self.llm.with_structured_output(ExtractedFields)
+            # Get JSON response - the schema is enforced server-side
+            response = self.json_llm.invoke(self._build_messages(ocr_text))
             
-            system_prompt = """# Identity
+            return self._build_extraction_result(json.loads(response.content))
             
-You are an expert at extracting information from Israeli National Insurance Institute (ביטוח לאומי) forms.
-
-# Instructions
-
-Your task is to extract specific fields from the OCR text and return them in valid JSON format. Follow the guidelines below:
-
-<guidelines>
-1. Extract information accurately from both Hebrew and English text
-2. For any field that is not present or cannot be extracted, use an empty string ""
-3. For Signature field, extract the text that is written right under 'חתימה X' or 'חתימהX'. If signature is not present, then leave it empty. \
-    For example, if the text is 'חתימה X\nJames', then the signature should be 'James'. \
-    If the text is 'חתימה X\n5 למילוי ע״י המוסד הרפואי :selected:', then signature does not appear, and the field should be left empty. \
-    Avoid inferring the signature from the text if it is not explicitly present. \
-4. For natureOfAccident and medicalDiagnoses fields, extract the text that is written under 'מהות התאונה (אבחנות רפואיות):', only if that field is selected in the form (:selected: מהות התאונה (אבחנות רפואיות):). \
-    The value of each of the fields should be an 4-character alphanumeric medical diagnosis code (e.g., ICD code). \
-    For example, if the text is ':selected: מהות התאונה (אבחנות רפואיות):\n1234\n5678', then the natureOfAccident field should be '1234' and the medicalDiagnoses field should be '5678'. \
-5. Return ONLY valid JSON that matches the specified schema
-</guidelines>"""
-
-            user_prompt = f"<ocr_text>\n{ocr_text}\n</ocr_text>"
-
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-            ]
-            
-            # Get structured response
-            result = structured_llm.invoke(messages)
-            
-            # Convert result to dict
-            extracted_dict = getattr(result, 'model_dump', lambda: result if isinstance(result, dict) else {})()
+        except Exception as e:
+            return self._build_error_result(e)
+    
+    async def aextract_fields(self, ocr_text: str) -> Dict[str, Any]:
+        """
+        Asynchronously extract fields from OCR text according to the schema
+        
+        Args:
+            ocr_text: Text extracted from the document
             
-            # Validate and clean data
-            cleaned_data = self._validate_and_clean_data(extracted_dict)
+        Returns:
+            Dictionary containing extracted fields and metadata
+        """
+        try:
+            # Get JSON response without blocking the event loop
+            response = await self.json_llm.ainvoke(self._build_messages(ocr_text))
             
-            # Return structured response
-            return {
-                "success": True,
-                "extracted_fields": cleaned_data,
-                "validation_warnings": self.validation_warnings,
-                "error": None
-            }
+            return self._build_extraction_result(json.loads(response.content))
             
         except Exception as e:
-            self.logger.error(f"Error during structured field extraction: {str(e)}")
-            return {
-                "success": False,
-                "error": str(e),
-                "extracted_fields": self.target_schema.copy(),
-                "validation_warnings": []
-            }
+            return self._build_error_result(e)
     
+    async def aextract_fields_batch(self, texts: List[str], max_concurrency: int = 16) -> List[Dict[str, Any]]:
+        """
+        Extract fields from several OCR texts concurrently
+        
+        Args:
+            texts: Texts extracted from the documents
+            max_concurrency: Maximum number of in-flight LLM requests
+            
+        Returns:
+            List of extraction results, in the same order as texts
+        """
+        sem = asyncio.Semaphore(max_concurrency)
+        
+        async def _bounded(text: str) -> Dict[str, Any]:
+            async with sem:
+                return await self.aextract_fields(text)
+        
+        return await asyncio.gather(*[_bounded(t) for t in texts])
     
-    # --- Validation and cleaning functions ---
-
-    def _validate_and_clean_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def submit_batch(self, ocr_texts: List[str]) -> str:
         """
-        Validate extracted data
+        Submit an offline extraction job through the Azure OpenAI Batch API
+        
+        Batch requests are billed at a discount compared to the real-time endpoint,
+        so this is preferred for non-interactive bulk extraction.
         
         Args:
-            data: Raw extracted data
+            ocr_texts: Texts extracted from the documents
             
         Returns:
-            Validated data 
+            The batch ID, to be passed to poll_batch
         """
-
-        # Perform validations on the data
-        self._validate_id_number(data)
-        self._validate_dates(data)
-        data = self._validate_phone_numbers(data)
-        self._validate_string_fields(data)
-        self._validate_numeric_fields(data)
-        self._validate_health_fund_member(data)
-        self._validate_gender(data)
-        self._validate_medical_diagnosis_codes(data)
+        client = self.llm.root_client
         
-        return data
+        # One chat completion request per document, identified by its index
+        requests = []
+        for i, ocr_text in enumerate(ocr_texts):
+            messages = [
+                {"role": "system" if isinstance(message, SystemMessage) else "user", "content": message.content}
+                for message in self._build_messages(ocr_text)
+            ]
+            requests.append(json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/chat/completions",
+                "body": {
+                    "model": self.llm.deployment_name,
+                    "temperature": self.llm.temperature,
+                    "messages": messages,
+                    "response_format": _RESPONSE_FORMAT
+                }
+            }, ensure_ascii=False))
+        
+        # Upload the requests file and create the batch job
+        batch_file = client.files.create(
+            file=("batch_input.jsonl", "\n".join(requests).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/chat/completions",
+            completion_window="24h"
+        )
+        
+        self.logger.info(f"Submitted batch {batch.id} with {len(requests)} requests")
+        return batch.id
     
-    def _add_validation_warning(self, field: str, message: str, value: str = ""):
+    def poll_batch(self, batch_id: str, poll_interval: float = 30.0) -> Iterator[Tuple[str, Dict[str, Any]]]:
         """
-        Add a validation warning to the collection
+        Wait for a batch job to finish and yield its extraction results
         
         Args:
-            field: Field name that has the validation issue
-            message: Description of the validation issue
-            value: The problematic value (optional)
+            batch_id: The batch ID returned by submit_batch
+            poll_interval: Seconds to wait between batch status checks
+            
+        Returns:
+            Iterator of (custom_id, extraction result) pairs, where custom_id is the
+            index of the document in the submitted list. Results may arrive in any order.
         """
-        warning = {
-            "field": field,
-            "message": message,
-            "value": value
-        }
-        self.validation_warnings.append(warning)
+        client = self.llm.root_client
+        
+        # Wait for the batch to reach a terminal status
+        batch = client.batches.retrieve(batch_id)
+        while batch.status not in _BATCH_TERMINAL_STATUSES:
+            time.sleep(poll_interval)
+            batch = client.batches.retrieve(batch_id)
+        
+        if batch.status != "completed" or not batch.output_file_id:
+            raise RuntimeError(f"Batch {batch_id} finished with status: {batch.status}")
+        
+        # Download the output file and parse each response
+        output = client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            try:
+                content = record["response"]["body"]["choices"][0]["message"]["content"]
+                yield record["custom_id"], self._build_extraction_result(json.loads(content))
+            except Exception as e:
+                yield record["custom_id"], self._build_error_result(e)
     
-    def _validate_id_number(self, data: Dict[str, Any]):
+    def _build_messages(self, ocr_text: str) -> List[BaseMessage]:
         """
-        Validate Israeli ID number format
+        Build the chat messages for a single extraction request
+        
+        Args:
+            ocr_text: Text extracted from the document
+            
+        Returns:
+            List of messages to send to the LLM
         """
-        id_number = data.get("idNumber", "")
-        if id_number and not re.match(r'^\d{9}$', id_number):
-            self.logger.warning(f"Invalid ID number format: {id_number}")
-            self._add_validation_warning("idNumber", "Invalid ID number format (should be 9 digits)", id_number)
+        user_prompt = f"<ocr_text>\n{_preprocess_ocr(ocr_text)}\n</ocr_text>"
+
+        return [
+            SystemMessage(content=_SYSTEM_PROMPT),
+            HumanMessage(content=user_prompt)
+        ]
     
-    def _validate_dates(self, data: Dict[str, Any]):
+    def _build_extraction_result(self, result: Any) -> Dict[str, Any]:
         """
-        Validate date fields
+        Validate a structured LLM response and wrap it in the extraction result format
+        
+        Args:
+            result: Parsed JSON response of the LLM
+            
+        Returns:
+            Dictionary containing extracted fields and metadata
         """
-        date_fields = ["dateOfBirth", "dateOfInjury", "formFillingDate", "formReceiptDateAtClinic"]
-        for field in date_fields:
-            if field in data and isinstance(data[field], dict):
-                day = data[field].get("day", "")
-                month = data[field].get("month", "")
-                year = data[field].get("year", "")
-                
-                # Basic validation
-                if day and not (1 <= int(day) <= 31 if day.isdigit() else False):
-                    self.logger.warning(f"Invalid day in {field}: {day}")
-                    self._add_validation_warning(f"{field}.day", "Invalid day (should be 1-31)", day)
-                if month and not (1 <= int(month) <= 12 if month.isdigit() else False):
-                    self.logger.warning(f"Invalid month in {field}: {month}")
-                    self._add_validation_warning(f"{field}.month", "Invalid month (should be 1-12)", month)
-                if year and len(year) != 4:
-                    self.logger.warning(f"Invalid year format in {field}: {year}")
-                    self._add_validation_warning(f"{field}.year", "Invalid year format (should be 4 digits)", year)
+        # Clear validation warnings for new extraction. Validation runs without
+        # awaiting, so concurrent async extractions cannot interleave here.
+        self.validation_warnings = []
+        
+        # The JSON response should be an object; anything else yields empty fields
+        extracted_dict = result if isinstance(result, dict) else {}
+        
+        # Validate and clean data
+        cleaned_data = self._validate_and_clean_data(extracted_dict)
+        
+        # Warnings are collected as (field, message, value) tuples and only turned into dicts here
+        validation_warnings = [
+            {"field": field, "message": message, "value": value}
+            for field, message, value in self.validation_warnings
+        ]
+        
+        # Return structured response
+        return {
+            "success": True,
+            "extracted_fields": cleaned_data,
+            "validation_warnings": validation_warnings,
+            "error": None
+        }
     
-    def _validate_phone_numbers(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def _build_error_result(self, error: Exception) -> Dict[str, Any]:
         """
-        Validate phone number formats
+        Build the extraction result returned when extraction fails
+        
+        Args:
+            error: The exception raised during extraction
+            
+        Returns:
+            Dictionary containing the default fields and the error message
+        """
+        self.logger.error(f"Error during structured field extraction: {str(error)}")
+        return {
+            "success": False,
+            "error": str(error),
+            "extracted_fields": copy.deepcopy(_EMPTY_SCHEMA),
+            "validation_warnings": []
+        }
+    
+    
+    # --- Validation and cleaning functions ---
 
+    def _validate_and_clean_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Validate extracted data in a single pass over the fields
+        
         Args:
             data: Raw extracted data
-
+            
         Returns:
-            None
+            Validated data 
         """
-        phone_fields = ["landlinePhone", "mobilePhone"]
-        for field in phone_fields:
+        address = data.get("address") or {}
+        if not isinstance(address, dict):
+            address = {}
+        medical_fields = data.get("medicalInstitutionFields") or {}
+        if not isinstance(medical_fields, dict):
+            medical_fields = {}
+        
+        # Validate Israeli ID number format
+        id_number = data.get("idNumber", "")
+        if id_number and not _ID_RE.match(id_number):
+            self.logger.warning(f"Invalid ID number format: {id_number}")
+            self._add_validation_warning("idNumber", "Invalid ID number format (should be 9 digits)", id_number)
+        
+        # Validate date fields
+        for field in _DATE_FIELDS:
+            date = data.get(field)
+            if not isinstance(date, dict):
+                continue
+            day = date.get("day", "")
+            month = date.get("month", "")
+            year = date.get("year", "")
+            
+            # Optional dates are usually left empty entirely
+            if not (day or month or year):
+                continue
+            
+            if day and not _in_range(day, 1, 31):
+                self.logger.warning(f"Invalid day in {field}: {day}")
+                self._add_validation_warning(f"{field}.day", "Invalid day (should be 1-31)", day)
+            if month and not _in_range(month, 1, 12):
+                self.logger.warning(f"Invalid month in {field}: {month}")
+                self._add_validation_warning(f"{field}.month", "Invalid month (should be 1-12)", month)
+            if year and len(year) != 4:
+                self.logger.warning(f"Invalid year format in {field}: {year}")
+                self._add_validation_warning(f"{field}.year", "Invalid year format (should be 4 digits)", year)
+        
+        # Validate phone number formats
+        for field in _PHONE_FIELDS:
             phone = data.get(field, "")
             if phone:
                 # If phone number is only one character, clear it
@@ -242,90 +464,64 @@ Your task is to extract specific fields from the OCR text and return them in val
                     data[field] = "" # Clear the field
                     self._add_validation_warning(field, "Phone number too short (cleared)", phone)
                 # Validate phone number format
-                elif not re.match(r'^[\d\-\s\+\(\)]+$', phone):
+                elif not _PHONE_RE.match(phone):
                     self.logger.warning(f"Invalid phone number format in {field}: {phone}")
                     self._add_validation_warning(field, "Invalid phone number format", phone)
-        return data
-    
-    def _validate_string_fields(self, data: Dict[str, Any]):
-        """
-        Validate string fields to ensure they contain only valid string characters (no digits)
-        """
-        # Direct string fields that should not contain digits
-        string_fields = [
-            "lastName", "firstName", "jobType", 
-            "accidentLocation", "accidentDescription",
-            "injuredBodyPart", "signature"
-        ]
         
-        for field in string_fields:
+        # Validate string fields that should not contain digits
+        for field in _STRING_FIELDS:
             value = data.get(field, "")
-            if value and re.search(r'\d', str(value)):
+            if value and not _DIGIT_CHARS.isdisjoint(value):
                 self.logger.warning(f"Field {field} should not contain digits but got: {value}")
                 self._add_validation_warning(field, "Field should not contain digits", value)
+        for field in _ADDRESS_STRING_FIELDS:
+            value = address.get(field, "")
+            if value and not _DIGIT_CHARS.isdisjoint(value):
+                self.logger.warning(f"Address field {field} should not contain digits but got: {value}")
+                self._add_validation_warning(f"address.{field}", "Address field should not contain digits", value)
         
-        # Address string fields that should not contain digits
-        address = data.get("address", {})
-        if isinstance(address, dict):
-            address_string_fields = ["street", "city"]
-            for field in address_string_fields:
-                value = address.get(field, "")
-                if value and re.search(r'\d', str(value)):
-                    self.logger.warning(f"Address field {field} should not contain digits but got: {value}")
-                    self._add_validation_warning(f"address.{field}", "Address field should not contain digits", value)
-    
-    def _validate_numeric_fields(self, data: Dict[str, Any]):
-        """
-        Validate numeric fields to ensure they contain only digits
-        """
-        address = data.get("address", {})
-        if isinstance(address, dict):
-            numeric_fields = ["houseNumber", "postalCode"] # Remaining fields are validated in _validate_string_fields
-            for field in numeric_fields:
-                value = address.get(field, "")
-                if value and not re.match(r'^\d+$', str(value)):
-                    self.logger.warning(f"Address field {field} should contain only digits but got: {value}")
-                    self._add_validation_warning(f"address.{field}", "Address field should contain only digits", value)
-    
-    def _validate_health_fund_member(self, data: Dict[str, Any]):
-        """
-        Validate healthFundMember field to ensure it's one of the allowed values
-        """
-        medical_fields = data.get("medicalInstitutionFields", {})
-        if isinstance(medical_fields, dict):
-            health_fund = medical_fields.get("healthFundMember", "")
-            valid_health_funds = ["כללית", "מאוחדת", "מכבי", "לאומית", ""]
-            
-            if health_fund and health_fund not in valid_health_funds:
-                self.logger.warning(f"healthFundMember should be one of {valid_health_funds} but got: {health_fund}")
-                self._add_validation_warning("medicalInstitutionFields.healthFundMember", f"Should be one of: {', '.join(valid_health_funds[:-1])}", health_fund)
-    
-    def _validate_gender(self, data: Dict[str, Any]):
-        """
-        Validate gender field to ensure it's one of the allowed values
-        """
+        # Validate numeric address fields that should contain only digits
+        for field in _ADDRESS_NUMERIC_FIELDS:
+            value = address.get(field, "")
+            if value and not _DIGITS_RE.match(value):
+                self.logger.warning(f"Address field {field} should contain only digits but got: {value}")
+                self._add_validation_warning(f"address.{field}", "Address field should contain only digits", value)
+        
+        # Validate healthFundMember is one of the allowed values
+        health_fund = medical_fields.get("healthFundMember", "")
+        if health_fund and health_fund not in _VALID_HEALTH_FUNDS:
+            self.logger.warning(f"healthFundMember should be one of {_VALID_HEALTH_FUNDS} but got: {health_fund}")
+            self._add_validation_warning("medicalInstitutionFields.healthFundMember", f"Should be one of: {', '.join(_VALID_HEALTH_FUNDS)}", health_fund)
+        
+        # Validate gender is one of the allowed values
         gender = data.get("gender", "")
-        valid_genders = ["זכר", "נקבה", ""]
+        if gender and gender not in _VALID_GENDERS:
+            self.logger.warning(f"gender should be one of {_VALID_GENDERS} but got: {gender}")
+            self._add_validation_warning("gender", f"Should be one of: {', '.join(_VALID_GENDERS)}", gender)
         
-        if gender and gender not in valid_genders:
-            self.logger.warning(f"gender should be one of {valid_genders} but got: {gender}")
-            self._add_validation_warning("gender", f"Should be one of: {', '.join(valid_genders[:-1])}", gender)
+        # Validate medical codes are 4-character alphanumeric
+        for field in _MEDICAL_CODE_FIELDS:
+            value = medical_fields.get(field, "")
+            if value and not _MED_CODE_RE.match(value):
+                self.logger.warning(f"Medical field {field} should be a 4-character alphanumeric code but got: {value}")
+                self._add_validation_warning(f"medicalInstitutionFields.{field}", "Should be a 4-character alphanumeric code", value)
+        
+        return data
     
-    def _validate_medical_diagnosis_codes(self, data: Dict[str, Any]):
+    def _add_validation_warning(self, field: str, message: str, value: str = ""):
         """
-        Validate natureOfAccident and medicalDiagnoses to ensure they are 4-character alphanumeric
+        Add a validation warning to the collection
+        
+        Args:
+            field: Field name that has the validation issue
+            message: Description of the validation issue
+            value: The problematic value (optional)
         """
-        medical_fields = data.get("medicalInstitutionFields", {})
-        if isinstance(medical_fields, dict):
-            medical_code_fields = ["natureOfAccident", "medicalDiagnoses"]
-            for field in medical_code_fields:
-                value = medical_fields.get(field, "")
-                if value and not re.match(r'^[A-Za-z0-9]{4}$', str(value)):
-                    self.logger.warning(f"Medical field {field} should be a 4-character alphanumeric code but got: {value}")
-                    self._add_validation_warning(f"medicalInstitutionFields.{field}", "Should be a 4-character alphanumeric code", value)
-
+        self.validation_warnings.append((field, message, value))
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+
     # Load environment variables from .env file
     load_dotenv()
 
@@ -350,12 +546,14 @@ if __name__ == "__main__":
         llm=AzureChatOpenAI(
             azure_deployment="gpt-4o",
             api_version="2024-12-01-preview",
-            temperature=0
+            temperature=0,
+            extra_body={"prompt_cache_key": PROMPT_CACHE_KEY}
         )
     )
 
-    # Extract fields from the OCR text using the chain
-    fields = field_extractor.extract_fields(result["extracted_text"])
+    # Extract fields from the OCR text through the Batch API (offline, discounted)
+    batch_id = field_extractor.submit_batch([result["extracted_text"]])
+    fields = dict(field_extractor.poll_batch(batch_id))["0"]
     
     # Write OCR text to a text file
     with open("part_1/ocr_test_result.txt", "w", encoding="utf-8") as f:
@@ -2,29 +2,57 @@ import os
 import json 
 import logging
 import io
+import asyncio
+import hashlib
 
-from typing import Dict, Any
+from types import MappingProxyType
+from typing import Dict, Any, IO, List, Optional, Union
 from dotenv import load_dotenv
+from diskcache import Cache
+from pypdf import PdfReader, PdfWriter
 from azure.core.credentials import AzureKeyCredential
 from azure.ai.documentintelligence import DocumentIntelligenceClient
+from azure.ai.documentintelligence.aio import DocumentIntelligenceClient as AsyncDocumentIntelligenceClient
+from azure.ai.documentintelligence.models import AnalyzeResult
+
+# OCR results are cached by document content for a day, up to 2 GB on disk
+OCR_CACHE_TTL = 24 * 60 * 60
+OCR_CACHE_SIZE_LIMIT = 2 * 1024 ** 3
+
+# Supported file extensions and their MIME types
+_CONTENT_TYPE_MAP = MappingProxyType({
+    '.pdf': 'application/pdf',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.tiff': 'image/tiff',
+    '.tif': 'image/tiff'
+})
 
 class DocumentOCRProcessor:
     """
     Azure Document Intelligence OCR processor for extracting text from documents
     """
     
-    def __init__(self, endpoint: str, api_key: str):
+    def __init__(self, endpoint: str, api_key: str, polling_interval: float = 1.0,
+                 cache_dir: Optional[str] = "./.ocr_cache"):
         """
         Initialize the Document Intelligence client
         
         Args:
             endpoint: Azure Document Intelligence endpoint
             api_key: Azure Document Intelligence API key
+            polling_interval: Seconds between status checks while an analysis is running
+            cache_dir: Directory of the OCR result cache, or None to disable caching
         """
+        self.endpoint = endpoint
+        self.polling_interval = polling_interval
+        self.credential = AzureKeyCredential(api_key)
         self.client = DocumentIntelligenceClient(
             endpoint=endpoint,
-            credential=AzureKeyCredential(api_key)
+            credential=self.credential
         )
+        self.cache = Cache(cache_dir, size_limit=OCR_CACHE_SIZE_LIMIT) if cache_dir else None
         
         # Setup logging
         logging.basicConfig(level=logging.INFO)
@@ -33,12 +61,12 @@ class DocumentOCRProcessor:
         logging.getLogger('azure').setLevel(logging.WARNING)
         self.logger = logging.getLogger(__name__)
     
-    def extract_text_from_document(self, file_content: bytes, content_type: str) -> Dict[str, Any]:
+    def extract_text_from_document(self, file_content: Union[bytes, IO[bytes]], content_type: str) -> Dict[str, Any]:
         """
         Extract text from document using Azure Document Intelligence
         
         Args:
-            file_content: Binary content of the file
+            file_content: Binary content of the file, or a binary file-like object to stream from
             content_type: MIME type of the file (e.g., 'application/pdf', 'image/jpeg')
             
         Returns:
@@ -48,84 +76,81 @@ class DocumentOCRProcessor:
             self.logger.info(f"Starting OCR extraction for document type: {content_type}")
             
             # Use the layout model for comprehensive text extraction
-            # Convert bytes to BytesIO for Azure SDK
-            file_stream = io.BytesIO(file_content)
+            # File-like objects are streamed to the Azure SDK as-is, raw bytes are wrapped in BytesIO
+            if isinstance(file_content, (bytes, bytearray)):
+                file_stream = io.BytesIO(file_content)
+            else:
+                file_stream = file_content
+                if file_stream.seekable():
+                    file_stream.seek(0)
+            
+            # Return the cached result if this exact document was already processed
+            cache_key = self._get_cache_key(file_stream, content_type)
+            cached_result = self.cache.get(cache_key) if cache_key is not None else None
+            if cached_result is not None:
+                self.logger.info("Returning cached OCR result")
+                return cached_result
+            
             poller = self.client.begin_analyze_document(
                 model_id="prebuilt-layout",
                 body=file_stream,
-                content_type=content_type
+                content_type=content_type,
+                polling_interval=self.polling_interval
             )
             
             result = poller.result()
             
-            # Extract all text content
-            extracted_text = ""
-            if result.content:
-                extracted_text = result.content
-            
-            # Extract structured information
-            structured_data = {
-                "content": extracted_text,
-                "pages": [],
-                "tables": [],
-                "key_value_pairs": []
-            }
-            
-            # Process pages
-            if result.pages:
-                for page in result.pages:
-                    page_info = {
-                        "page_number": page.page_number,
-                        "text": "",
-                        "lines": []
-                    }
-                    
-                    if page.lines:
-                        for line in page.lines:
-                            page_info["lines"].append({
-                                "text": line.content,
-                                "bounding_box": line.polygon if hasattr(line, 'polygon') else None
-                            })
-                            page_info["text"] += line.content + "\n"
-                    
-                    structured_data["pages"].append(page_info)
-            
-            # Process tables if any
-            if result.tables:
-                for table in result.tables:
-                    table_data = {
-                        "row_count": table.row_count,
-                        "column_count": table.column_count,
-                        "cells": []
-                    }
-                    
-                    if table.cells:
-                        for cell in table.cells:
-                            table_data["cells"].append({
-                                "content": cell.content,
-                                "row_index": cell.row_index,
-                                "column_index": cell.column_index
-                            })
-                    
-                    structured_data["tables"].append(table_data)
-            
-            # Process key-value pairs if any
-            if result.key_value_pairs:
-                for kv_pair in result.key_value_pairs:
-                    kv_data = {
-                        "key": kv_pair.key.content if kv_pair.key else "",
-                        "value": kv_pair.value.content if kv_pair.value else ""
-                    }
-                    structured_data["key_value_pairs"].append(kv_data)
-            
-            self.logger.info(f"OCR extraction completed. Extracted {len(extracted_text)} characters")
+            return self._cache_ocr_result(cache_key, self._build_ocr_result(result))
             
+        except Exception as e:
+            self.logger.error(f"Error during OCR extraction: {str(e)}")
             return {
-                "success": True,
-                "extracted_text": extracted_text,
-                "structured_data": structured_data,
-                "page_count": len(result.pages) if result.pages else 0
+                "success": False,
+                "error": str(e),
+                "extracted_text": "",
+                "structured_data": None
             }
+    
+    async def aextract_text_from_document(self, file_content: Union[bytes, IO[bytes]], content_type: str) -> Dict[str, Any]:
+        """
+        Asynchronously extract text from document using Azure Document Intelligence
+        
+        Args:
+            file_content: Binary content of the file, or a binary file-like object to stream from
+            content_type: MIME type of the file (e.g., 'application/pdf', 'image/jpeg')
+            
+        Returns:
+            Dictionary containing extracted text and metadata
+        """
+        try:
+            self.logger.info(f"Starting OCR extraction for document type: {content_type}")
+            
+            # File-like objects are streamed to the Azure SDK as-is, raw bytes are wrapped in BytesIO
+            if isinstance(file_content, (bytes, bytearray)):
+                file_stream = io.BytesIO(file_content)
+            else:
+                file_stream = file_content
+                if file_stream.seekable():
+                    file_stream.seek(0)
+            
+            # Return the cached result if this exact document was already processed
+            cache_key = self._get_cache_key(file_stream, content_type)
+            cached_result = self.cache.get(cache_key) if cache_key is not None else None
+            if cached_result is not None:
+                self.logger.info("Returning cached OCR result")
+                return cached_result
+            
+            # The async client is scoped to the running event loop
+            async with AsyncDocumentIntelligenceClient(endpoint=self.endpoint, credential=self.credential) as client:
+                poller = await client.begin_analyze_document(
+                    model_id="prebuilt-layout",
+                    body=file_stream,
+                    content_type=content_type,
+                    polling_interval=self.polling_interval
+                )
+                result = await poller.result()
+            
+            return self._cache_ocr_result(cache_key, self._build_ocr_result(result))
             
         except Exception as e:
             self.logger.error(f"Error during OCR extraction: {str(e)}")
@@ -136,6 +161,120 @@ class DocumentOCRProcessor:
                 "structured_data": None
             }
     
+    def _get_cache_key(self, file_stream: IO[bytes], content_type: str) -> Optional[str]:
+        """
+        Hash the document content to build its cache key
+        
+        Args:
+            file_stream: Binary stream of the document (rewound after hashing)
+            content_type: MIME type of the file
+            
+        Returns:
+            Cache key, or None if caching is disabled or the stream can't be rewound
+        """
+        if self.cache is None or not file_stream.seekable():
+            return None
+        
+        digest = hashlib.blake2b(digest_size=16)
+        while chunk := file_stream.read(65536):
+            digest.update(chunk)
+        file_stream.seek(0)
+        return f"{content_type}:{digest.hexdigest()}"
+    
+    def _cache_ocr_result(self, cache_key: Optional[str], ocr_result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Store a successful OCR result in the cache
+        
+        Args:
+            cache_key: Key returned by _get_cache_key
+            ocr_result: Result of _build_ocr_result
+            
+        Returns:
+            The same OCR result
+        """
+        if cache_key is not None:
+            self.cache.set(cache_key, ocr_result, expire=OCR_CACHE_TTL)
+        return ocr_result
+    
+    def _build_ocr_result(self, result: AnalyzeResult) -> Dict[str, Any]:
+        """
+        Convert a Document Intelligence analysis result to the OCR result format
+        
+        Args:
+            result: Result of the layout analysis
+            
+        Returns:
+            Dictionary containing extracted text and metadata
+        """
+        # Extract all text content
+        extracted_text = ""
+        if result.content:
+            extracted_text = result.content
+        
+        # Extract structured information
+        structured_data = {
+            "content": extracted_text,
+            "pages": [],
+            "tables": [],
+            "key_value_pairs": []
+        }
+        
+        # Process pages
+        if result.pages:
+            append_page = structured_data["pages"].append
+            for page in result.pages:
+                lines = page.lines or []
+                page_info = {
+                    "page_number": page.page_number,
+                    # Join once instead of growing the string line by line
+                    "text": "".join(line.content + "\n" for line in lines),
+                    "lines": [
+                        {"text": line.content, "bounding_box": getattr(line, 'polygon', None)}
+                        for line in lines
+                    ]
+                }
+                
+                append_page(page_info)
+        
+        # Process tables if any
+        if result.tables:
+            for table in result.tables:
+                table_data = {
+                    "row_count": table.row_count,
+                    "column_count": table.column_count,
+                    "cells": []
+                }
+                
+                if table.cells:
+                    table_data["cells"] = [
+                        {
+                            "content": cell.content,
+                            "row_index": cell.row_index,
+                            "column_index": cell.column_index
+                        }
+                        for cell in table.cells
+                    ]
+                
+                structured_data["tables"].append(table_data)
+        
+        # Process key-value pairs if any
+        if result.key_value_pairs:
+            for kv_pair in result.key_value_pairs:
+                kv_data = {
+                    "key": kv_pair.key.content if kv_pair.key else "",
+                    "value": kv_pair.value.content if kv_pair.value else ""
+                }
+                structured_data["key_value_pairs"].append(kv_data)
+        
+        self.logger.info(f"OCR extraction completed. Extracted {len(extracted_text)} characters")
+        
+        return {
+            "success": True,
+            "extracted_text": extracted_text,
+            "structured_data": structured_data,
+            "page_count": len(result.pages) if result.pages else 0
+        }
+    
     def extract_from_file_path(self, file_path: str) -> Dict[str, Any]:
         """
         Extract text from a file given its path
@@ -147,26 +286,36 @@ class DocumentOCRProcessor:
             Dictionary containing extracted text and metadata
         """
         try:
-            # Determine content type based on file extension
-            _, ext = os.path.splitext(file_path.lower())
-            content_type_map = {
-                '.pdf': 'application/pdf',
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg',
-                '.png': 'image/png',
-                '.tiff': 'image/tiff',
-                '.tif': 'image/tiff'
-            }
+            content_type = self._get_content_type(file_path)
             
-            content_type = content_type_map.get(ext)
-            if not content_type:
-                raise ValueError(f"Unsupported file type: {ext}")
+            # Stream the file to Azure through a buffered handle instead of reading it into memory
+            with open(file_path, 'rb', buffering=65536) as file:
+                return self.extract_text_from_document(file, content_type)
             
-            # Read file content
-            with open(file_path, 'rb') as file:
-                file_content = file.read()
+        except Exception as e:
+            self.logger.error(f"Error reading file {file_path}: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "extracted_text": "",
+                "structured_data": None
+            }
+    
+    async def aextract_from_file_path(self, file_path: str) -> Dict[str, Any]:
+        """
+        Asynchronously extract text from a file given its path
+        
+        Args:
+            file_path: Path to the file
             
-            return self.extract_text_from_document(file_content, content_type)
+        Returns:
+            Dictionary containing extracted text and metadata
+        """
+        try:
+            content_type = self._get_content_type(file_path)
+            
+            with open(file_path, 'rb', buffering=65536) as file:
+                return await self.aextract_text_from_document(file, content_type)
             
         except Exception as e:
             self.logger.error(f"Error reading file {file_path}: {str(e)}")
@@ -176,6 +325,144 @@ class DocumentOCRProcessor:
                 "extracted_text": "",
                 "structured_data": None
             }
+    
+    async def extract_many(self, paths: List[str], concurrency: int = 10) -> List[Dict[str, Any]]:
+        """
+        Extract text from several files concurrently
+        
+        Args:
+            paths: Paths to the files
+            concurrency: Maximum number of documents analyzed at once (keep within the Azure rate limit)
+            
+        Returns:
+            List of OCR results, in the same order as paths
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def run(path: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.aextract_from_file_path(path)
+        
+        return await asyncio.gather(*(run(path) for path in paths))
+    
+    def _get_content_type(self, file_path: str) -> str:
+        """
+        Determine the MIME type of a file based on its extension
+        
+        Args:
+            file_path: Path to the file
+            
+        Returns:
+            MIME type of the file
+        """
+        _, ext = os.path.splitext(file_path.lower())
+        content_type = _CONTENT_TYPE_MAP.get(ext)
+        if not content_type:
+            raise ValueError(f"Unsupported file type: {ext}")
+        return content_type
+
+    def extract_from_large_file_path(self, file_path: str, pages_per_part: int = 10) -> Dict[str, Any]:
+        """
+        Extract text from a large PDF by analyzing page ranges concurrently
+        
+        Args:
+            file_path: Path to the PDF file
+            pages_per_part: Number of pages sent to Azure in each sub-request
+            
+        Returns:
+            Dictionary containing extracted text and metadata
+        """
+        return asyncio.run(self.aextract_from_large_file_path(file_path, pages_per_part))
+    
+    async def aextract_from_large_file_path(self, file_path: str, pages_per_part: int = 10) -> Dict[str, Any]:
+        """
+        Asynchronously extract text from a large PDF by analyzing page ranges concurrently
+        
+        Args:
+            file_path: Path to the PDF file
+            pages_per_part: Number of pages sent to Azure in each sub-request
+            
+        Returns:
+            Dictionary containing extracted text and metadata
+        """
+        try:
+            if not file_path.lower().endswith('.pdf'):
+                raise ValueError(f"Only PDF files can be split: {file_path}")
+            
+            # Split the PDF into sub-documents of at most pages_per_part pages
+            reader = PdfReader(file_path)
+            page_count = len(reader.pages)
+            parts: List[bytes] = []
+            for start in range(0, page_count, pages_per_part):
+                writer = PdfWriter()
+                for page in reader.pages[start:start + pages_per_part]:
+                    writer.add_page(page)
+                buffer = io.BytesIO()
+                writer.write(buffer)
+                parts.append(buffer.getvalue())
+            
+            self.logger.info(f"Split {file_path} ({page_count} pages) into {len(parts)} parts")
+            
+            async def extract_part(part: bytes) -> Dict[str, Any]:
+                result = await self.aextract_text_from_document(part, 'application/pdf')
+                if not result["success"]:
+                    # Retry a failed part once instead of restarting the whole document
+                    self.logger.warning(f"Retrying failed OCR part: {result['error']}")
+                    result = await self.aextract_text_from_document(part, 'application/pdf')
+                return result
+            
+            part_results = await asyncio.gather(*(extract_part(part) for part in parts))
+            
+            for part_result in part_results:
+                if not part_result["success"]:
+                    raise RuntimeError(part_result["error"])
+            
+            return self._merge_ocr_results(part_results, pages_per_part)
+            
+        except Exception as e:
+            self.logger.error(f"Error processing large file {file_path}: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "extracted_text": "",
+                "structured_data": None
+            }
+    
+    def _merge_ocr_results(self, part_results: List[Dict[str, Any]], pages_per_part: int) -> Dict[str, Any]:
+        """
+        Merge OCR results of consecutive page ranges into a single result
+        
+        Args:
+            part_results: OCR results in page order
+            pages_per_part: Number of pages in each part (used to offset page numbers)
+            
+        Returns:
+            Dictionary containing extracted text and metadata
+        """
+        extracted_text = "\n".join(part["extracted_text"] for part in part_results)
+        structured_data = {
+            "content": extracted_text,
+            "pages": [],
+            "tables": [],
+            "key_value_pairs": []
+        }
+        page_count = 0
+        
+        for i, part in enumerate(part_results):
+            part_data = part["structured_data"]
+            offset = i * pages_per_part
+            for page_info in part_data["pages"]:
+                structured_data["pages"].append({**page_info, "page_number": page_info["page_number"] + offset})
+            structured_data["tables"].extend(part_data["tables"])
+            structured_data["key_value_pairs"].extend(part_data["key_value_pairs"])
+            page_count += part["page_count"]
+        
+        return {
+            "success": True,
+            "extracted_text": extracted_text,
+            "structured_data": structured_data,
+            "page_count": page_count
+        }
 
 
 if __name__ == "__main__":
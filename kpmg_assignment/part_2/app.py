@@ -1,24 +1,77 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, ORJSONResponse
 import uvicorn
 import os
-from typing import List, Dict, Any
+import orjson
+import anyio
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, AsyncIterator
 from dotenv import load_dotenv
 
 # Import the correct workflow and dependencies
 from workflow.workflow import Workflow, WorkflowState
 from models.schemas import ChatRequest, ChatResponse, ChatMessage, UserProfile
 from services.vector_service import VectorService
+from services.response_cache import ResponseCache
+from services import embeddings_pool
 from langchain_openai import AzureChatOpenAI
 from langchain.schema import HumanMessage, AIMessage, BaseMessage
 
 # Load environment variables
 load_dotenv()
 
+# Server-side conversation state: with REDIS_URL set, requests carrying a session_id only send the
+# new message and the workflow resumes the stored conversation (shared by all API replicas)
+REDIS_URL = os.getenv("REDIS_URL")
+checkpointer = None
+if REDIS_URL:
+    from langgraph.checkpoint.redis.aio import AsyncRedisSaver
+    checkpointer = AsyncRedisSaver(redis_url=REDIS_URL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize the worker's services on startup and release shared clients on shutdown"""
+    # Allow more concurrent sync endpoints/dependencies than anyio's default of 40 threads
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 200
+    if checkpointer is not None:
+        # Create the checkpoint indices in Redis
+        await checkpointer.asetup()
+    
+    try:
+        # Initialize Azure OpenAI
+        llm = AzureChatOpenAI(
+            azure_deployment="gpt-4o",
+            api_version="2024-12-01-preview",
+            temperature=0
+        )
+        
+        # Load the FAISS index and its documents once per worker, shared by the agent tools and /vector-store/stats
+        app.state.vector_service = VectorService("indexes")
+        
+        # Initialize Q&A response cache (shares the vector service's embeddings client)
+        app.state.response_cache = ResponseCache(app.state.vector_service.embeddings)
+        
+        # Initialize workflow
+        workflow_instance = Workflow(llm=llm, vector_service=app.state.vector_service)
+        app.state.compiled_workflow = workflow_instance.build_workflow()
+        app.state.session_workflow = workflow_instance.build_workflow(checkpointer=checkpointer) if checkpointer is not None else None
+        
+        print("✅ All services initialized successfully")
+        
+    except Exception as e:
+        print(f"❌ Error initializing services: {e}")
+        raise
+    
+    yield
+    await embeddings_pool.aclose()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Medical Services ChatBot API",
     description="Microservice-based ChatBot for Medical Services Q&A",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware to allow frontend connections
@@ -30,39 +83,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class ChatService:
-    """Simple chat service to handle basic functionality"""
-    def __init__(self):
-        pass
-    
-    def get_welcome_message(self) -> str:
-        """Get welcome message"""
-        return "Hi there! I am the HMO services chatbot. I would be happy to help you with questions about your HMO services. I can answer in both Hebrew and English. Can you please tell me your name?"
-
-# Initialize services
-try:
-    # Initialize Azure OpenAI
-    llm = AzureChatOpenAI(
-        azure_deployment="gpt-4o",
-        api_version="2024-12-01-preview",
-        temperature=0
-    )
-    
-    # Initialize vector service
-    vector_service = VectorService("indexes")
-    
-    # Initialize workflow
-    workflow_instance = Workflow(llm=llm, vector_service=vector_service)
-    compiled_workflow = workflow_instance.build_workflow()
-    
-    # Initialize simple chat service
-    chat_service = ChatService()
-    
-    print("✅ All services initialized successfully")
-    
-except Exception as e:
-    print(f"❌ Error initializing services: {e}")
-    raise
+# Welcome message, served as a prebuilt response body
+_WELCOME = "Hi there! I am the HMO services chatbot. I would be happy to help you with questions about your HMO services. I can answer in both Hebrew and English. Can you please tell me your name?"
+_WELCOME_RESPONSE = {"message": _WELCOME}
 
 def convert_chat_history_to_langchain_messages(chat_history: List[ChatMessage]) -> List[BaseMessage]:
     """Convert ChatMessage list to LangChain message format"""
@@ -81,22 +104,108 @@ def extract_response_from_workflow_result(final_state: Dict[str, Any]) -> tuple[
     
     # Get the last assistant message from the final state
     for node_name, node_update in final_state.items():
-        if "messages" in node_update:
+        if not response_message and "messages" in node_update:
             messages = node_update["messages"]
-            # Find the last AI message
-            for msg in reversed(messages):
-                if isinstance(msg, AIMessage) and hasattr(msg, 'content') and isinstance(msg.content, str):
-                    response_message = msg.content
-                    break
-            if response_message:
-                break
+            # The newest message is always last
+            last_message = messages[-1] if messages else None
+            if isinstance(last_message, AIMessage) and isinstance(last_message.content, str):
+                response_message = last_message.content
         
         # Get user profile if available
         if "user_profile" in node_update and node_update["user_profile"]:
             user_profile = node_update["user_profile"]
+        
+        if response_message and user_profile is not None:
+            break
     
     return response_message, user_profile
 
+def uses_session(request: ChatRequest) -> bool:
+    """Whether the request's conversation state is stored server-side"""
+    return app.state.session_workflow is not None and bool(request.session_id)
+
+def get_workflow_run(request: ChatRequest) -> tuple[Any, Dict[str, Any]]:
+    """Get the compiled workflow and run config for a request"""
+    if uses_session(request):
+        return app.state.session_workflow, {"recursion_limit": 50, "configurable": {"thread_id": request.session_id}}
+    return app.state.compiled_workflow, {"recursion_limit": 50}
+
+def build_initial_state(request: ChatRequest) -> WorkflowState:
+    """Build the workflow input from the request's history and current message"""
+    if uses_session(request):
+        # The stored conversation already has the history (and transcript); only add the new turn
+        session_state = {"messages": [HumanMessage(content=request.message)]}
+        if request.user_profile is not None:
+            session_state["user_profile"] = request.user_profile
+        return session_state
+    
+    # Convert chat history to LangChain message format
+    langchain_messages = convert_chat_history_to_langchain_messages(request.conversation_history)
+    
+    # Add the current user message
+    langchain_messages.append(HumanMessage(content=request.message))
+    
+    return {
+        "messages": langchain_messages,
+        "user_profile": request.user_profile
+    }
+
+def response_cache_profile(request: ChatRequest) -> UserProfile | None:
+    """Get the user profile to partition the response cache by, or None if the turn must not be cached
+    
+    Only standalone Q&A questions of stateless requests are cached: onboarding turns and
+    follow-ups depend on the conversation, and session turns must reach the stored conversation.
+    """
+    if request.user_profile is None or uses_session(request):
+        return None
+    if not app.state.response_cache.is_cacheable(request.message):
+        return None
+    return request.user_profile
+
+async def lookup_cached_response(request: ChatRequest) -> tuple[ChatResponse | None, Any]:
+    """Look up a cached answer for the request
+    
+    Returns:
+        tuple[ChatResponse | None, Any]: The cached response (or None) and the question
+        embedding to pass to store_cached_response()
+    """
+    profile = response_cache_profile(request)
+    if profile is None:
+        return None, None
+    try:
+        cached_message, cache_vector = await app.state.response_cache.lookup(
+            profile.hmo, profile.insurance_tier, request.message
+        )
+    except Exception as cache_error:
+        print(f"Response cache lookup failed: {cache_error}")
+        return None, None
+    if cached_message is None:
+        return None, cache_vector
+    return ChatResponse(
+        message=cached_message,
+        user_profile=profile,
+        phase="qa",
+        requires_confirmation=False
+    ), cache_vector
+
+async def store_cached_response(request: ChatRequest, response_message: str, cache_vector: Any = None):
+    """Cache the workflow's answer to the request, unless it is context-dependent or personal"""
+    profile = response_cache_profile(request)
+    if profile is None or not app.state.response_cache.is_shareable(
+        response_message, [profile.first_name, profile.last_name, profile.national_id]
+    ):
+        return
+    try:
+        await app.state.response_cache.store(
+            profile.hmo, profile.insurance_tier, request.message, response_message, cache_vector
+        )
+    except Exception as cache_error:
+        print(f"Response cache store failed: {cache_error}")
+
+def format_sse(payload: Dict[str, Any]) -> str:
+    """Format a payload as a Server-Sent Events data line"""
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
 def determine_phase(user_profile: UserProfile | None, response_message: str) -> str:
     """Determine the current phase based on user profile and response"""
     if user_profile is not None:
@@ -112,7 +221,7 @@ async def root():
 @app.get("/welcome")
 async def get_welcome_message():
     """Get initial welcome message"""
-    return {"message": chat_service.get_welcome_message()}
+    return _WELCOME_RESPONSE
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
@@ -122,24 +231,21 @@ async def chat(request: ChatRequest):
         if not request.message.strip():
             raise HTTPException(status_code=400, detail="Message cannot be empty")
         
-        # Convert chat history to LangChain message format
-        langchain_messages = convert_chat_history_to_langchain_messages(request.conversation_history)
-        
-        # Add the current user message
-        langchain_messages.append(HumanMessage(content=request.message))
+        # Serve repeated standalone Q&A questions from the cache
+        cached_response, cache_vector = await lookup_cached_response(request)
+        if cached_response is not None:
+            return cached_response
         
         # Prepare initial state for workflow
-        initial_state: WorkflowState = {
-            "messages": langchain_messages,
-            "user_profile": request.user_profile
-        }
+        initial_state = build_initial_state(request)
+        workflow_run, run_config = get_workflow_run(request)
         
-        # Run the workflow
+        # Run the workflow without blocking the event loop
         final_state = None
         try:
-            for chunk in compiled_workflow.stream(
+            async for chunk in workflow_run.astream(
                 initial_state,
-                config={"recursion_limit": 50}
+                config=run_config
             ):
                 final_state = chunk
         except Exception as workflow_error:
@@ -154,6 +260,8 @@ async def chat(request: ChatRequest):
         
         if not response_message:
             response_message = "מצטער, אני לא הצלחתי לעבד את הבקשה שלך. אנא נסה שוב."
+        else:
+            await store_cached_response(request, response_message, cache_vector)
         
         # Determine current phase
         current_phase = determine_phase(updated_user_profile, response_message)
@@ -176,20 +284,88 @@ async def chat(request: ChatRequest):
         print(f"Error processing chat request: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Streaming chat endpoint - sends response tokens as Server-Sent Events
+    
+    Emits {"type": "token", "content": ...} events while the agents generate the answer,
+    then a single {"type": "final", ...} event with the ChatResponse fields,
+    or {"type": "error", "detail": ...} if the workflow fails.
+    """
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    
+    initial_state = build_initial_state(request)
+    workflow_run, run_config = get_workflow_run(request)
+    
+    async def event_generator() -> AsyncIterator[str]:
+        # A cached answer is sent whole, as the final event
+        cached_response, cache_vector = await lookup_cached_response(request)
+        if cached_response is not None:
+            yield format_sse({"type": "final", **cached_response.model_dump(mode="json")})
+            return
+        
+        final_values = None
+        try:
+            async for event in workflow_run.astream_events(
+                initial_state,
+                config=run_config,
+                version="v2"
+            ):
+                kind = event["event"]
+                # Only stream tokens of the user-facing agents, not the extraction tool's LLM
+                if kind == "on_chat_model_stream" and event["metadata"].get("langgraph_node") in ("collector_agent", "qa_agent"):
+                    content = event["data"]["chunk"].content
+                    if content:
+                        yield format_sse({"type": "token", "content": content})
+                # The root graph's end event carries the final state
+                elif kind == "on_chain_end" and not event["parent_ids"]:
+                    final_values = event["data"]["output"]
+        except Exception as workflow_error:
+            print(f"Workflow error: {workflow_error}")
+            yield format_sse({"type": "error", "detail": f"Workflow execution failed: {str(workflow_error)}"})
+            return
+        
+        if not final_values:
+            yield format_sse({"type": "error", "detail": "No response from workflow"})
+            return
+        
+        response_message, updated_user_profile = extract_response_from_workflow_result({"final": final_values})
+        if not response_message:
+            response_message = "מצטער, אני לא הצלחתי לעבד את הבקשה שלך. אנא נסה שוב."
+        else:
+            await store_cached_response(request, response_message, cache_vector)
+        
+        current_phase = determine_phase(updated_user_profile, response_message)
+        requires_confirmation = (updated_user_profile is not None and 
+                               current_phase == "qa" and 
+                               request.user_profile is None)
+        
+        response = ChatResponse(
+            message=response_message,
+            user_profile=updated_user_profile,
+            phase=current_phase,
+            requires_confirmation=requires_confirmation
+        )
+        yield format_sse({"type": "final", **response.model_dump(mode="json")})
+    
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
 @app.get("/vector-store/stats")
 async def get_vector_store_stats():
     """Get vector store statistics"""
     try:
-        stats = vector_service.get_stats()
+        stats = app.state.vector_service.get_stats()
         return stats
     except Exception as e:
         print(f"Error getting vector store stats: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving vector store statistics")
 
 if __name__ == "__main__":
+    # Single-process server for local runs; uvicorn picks up uvloop/httptools when installed.
+    # For production use: gunicorn -c gunicorn_config.py app:app
     uvicorn.run(
         "app:app",
         host="0.0.0.0",
-        port=8000,
-        reload=True
+        port=8000
     )
\ No newline at end of file
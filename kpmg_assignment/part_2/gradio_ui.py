@@ -6,18 +6,28 @@ Gradio frontend for Medical Services ChatBot
 import gradio as gr
 import httpx
 import json
-from typing import List, Dict, Any, Optional, Tuple
+import orjson
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 from datetime import datetime
 import asyncio
 
 # API Configuration
 API_BASE_URL = "http://localhost:8000"
 
+# Shared HTTP client so connections to the API are reused across requests
+_client = httpx.AsyncClient(
+    base_url=API_BASE_URL,
+    timeout=30.0,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+)
+
 class ChatState:
     """Client-side state management"""
     
     def __init__(self):
         self.conversation_history = []
+        # (user, assistant) pairs as displayed by the Gradio chatbot, kept in sync with the history
+        self.pairs: List[Tuple[Optional[str], Optional[str]]] = []
         self.user_profile = None
         self.phase = "onboarding"
         self.requires_confirmation = False
@@ -29,6 +39,21 @@ class ChatState:
             "content": content,
             "timestamp": datetime.now().isoformat()
         })
+        
+        if role == "user":
+            if self.pairs and self.pairs[-1][1] is None:
+                # Update the last user message
+                self.pairs[-1] = (content, None)
+            else:
+                # Add new user message
+                self.pairs.append((content, None))
+        elif role == "assistant":
+            if self.pairs:
+                # Add assistant response to the last user message
+                self.pairs[-1] = (self.pairs[-1][0], content)
+            else:
+                # Shouldn't happen, but handle gracefully
+                self.pairs.append(("", content))
     
     def set_user_profile(self, profile_data: Dict[str, Any]):
         """Set user profile"""
@@ -53,18 +78,17 @@ chat_state = ChatState()
 async def get_welcome_message() -> str:
     """Get welcome message from API"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{API_BASE_URL}/welcome")
-            if response.status_code == 200:
-                return response.json()["message"]
-            else:
-                return "Welcome to Medical Services ChatBot!"
+        response = await _client.get("/welcome")
+        if response.status_code == 200:
+            return response.json()["message"]
+        else:
+            return "Welcome to Medical Services ChatBot!"
     except Exception as e:
         print(f"Error getting welcome message: {e}")
         return "Welcome to Medical Services ChatBot!"
 
-async def send_message_to_api(message: str) -> Tuple[str, str, bool]:
-    """Send message to API and return response"""
+async def stream_message_to_api(message: str) -> AsyncIterator[Dict[str, Any]]:
+    """Send message to the streaming API and yield its events as they arrive"""
     try:
         request_data = {
             "message": message,
@@ -73,74 +97,65 @@ async def send_message_to_api(message: str) -> Tuple[str, str, bool]:
             "phase": chat_state.phase
         }
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{API_BASE_URL}/chat",
-                json=request_data
-            )
+        async with _client.stream(
+            "POST",
+            "/chat/stream",
+            content=orjson.dumps(request_data),
+            headers={"content-type": "application/json"}
+        ) as response:
+            if response.status_code != 200:
+                yield {"type": "error", "detail": f"API Error: {response.status_code}"}
+                return
             
-            if response.status_code == 200:
-                result = response.json()
-                return result["message"], result["phase"], result.get("requires_confirmation", False)
-            else:
-                error_msg = f"API Error: {response.status_code}"
-                try:
-                    error_detail = response.json().get("detail", "Unknown error")
-                    error_msg += f" - {error_detail}"
-                except:
-                    pass
-                return error_msg, chat_state.phase, False
+            # Each Server-Sent Event is a "data: {...}" line
+            async for line in response.aiter_lines():
+                if line.startswith("data: "):
+                    yield orjson.loads(line[6:])
                 
     except httpx.TimeoutException:
-        return "Request timed out. Please try again.", chat_state.phase, False
+        yield {"type": "error", "detail": "Request timed out. Please try again."}
     except Exception as e:
-        print(f"Error sending message to API: {e}")
-        return f"Error: {str(e)}", chat_state.phase, False
+        print(f"Error streaming message from API: {e}")
+        yield {"type": "error", "detail": f"Error: {str(e)}"}
 
 def format_chat_history() -> List[Tuple[str, str]]:
     """Format conversation history for Gradio chatbot"""
-    formatted_history = []
-    
-    for msg in chat_state.conversation_history:
-        if msg["role"] == "user":
-            if formatted_history and formatted_history[-1][1] is None:
-                # Update the last user message
-                formatted_history[-1] = (msg["content"], None)
-            else:
-                # Add new user message
-                formatted_history.append((msg["content"], None))
-        elif msg["role"] == "assistant":
-            if formatted_history:
-                # Add assistant response to the last user message
-                formatted_history[-1] = (formatted_history[-1][0], msg["content"])
-            else:
-                # Shouldn't happen, but handle gracefully
-                formatted_history.append(("", msg["content"]))
-    
-    return formatted_history
+    # Pairs are maintained incrementally by ChatState.add_message; copy so Gradio can't mutate state
+    return list(chat_state.pairs)
 
-async def process_user_message(message: str, history: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], str]:
-    """Process user message and return updated history"""
+async def process_user_message(message: str, history: List[Tuple[str, str]]) -> AsyncIterator[Tuple[List[Tuple[str, str]], str]]:
+    """Process user message and yield the updated history as the response streams in"""
     if not message.strip():
-        return history, ""
+        yield history, ""
+        return
     
     # Add user message to state
     chat_state.add_message("user", message)
+    updated_history = format_chat_history()
     
-    # Send to API
-    response_message, new_phase, requires_confirmation = await send_message_to_api(message)
-    
-    # Update state
-    chat_state.phase = new_phase
-    chat_state.requires_confirmation = requires_confirmation
+    # Stream the response, showing tokens as they arrive
+    partial_response = ""
+    response_message = ""
+    async for event in stream_message_to_api(message):
+        if event["type"] == "token":
+            partial_response += event["content"]
+            yield updated_history[:-1] + [(message, partial_response)], ""
+        elif event["type"] == "final":
+            response_message = event["message"]
+            # Update state
+            chat_state.phase = event["phase"]
+            chat_state.requires_confirmation = event.get("requires_confirmation", False)
+            # Send the profile with later questions so the API can answer them from its cache
+            if event.get("user_profile"):
+                chat_state.set_user_profile(event["user_profile"])
+        elif event["type"] == "error":
+            response_message = event["detail"]
     
     # Add assistant response to state
     chat_state.add_message("assistant", response_message)
     
     # Format updated history
-    updated_history = format_chat_history()
-    
-    return updated_history, ""
+    yield format_chat_history(), ""
 
 def reset_conversation():
     """Reset the conversation"""
@@ -163,28 +178,26 @@ def get_current_phase_info() -> str:
 async def get_api_status() -> str:
     """Check API status"""
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{API_BASE_URL}/")
-            if response.status_code == 200:
-                return "🟢 API Connected"
-            else:
-                return f"🔴 API Error: {response.status_code}"
+        response = await _client.get("/", timeout=5.0)
+        if response.status_code == 200:
+            return "🟢 API Connected"
+        else:
+            return f"🔴 API Error: {response.status_code}"
     except Exception as e:
         return f"🔴 API Offline: {str(e)}"
 
 async def get_vector_store_status() -> str:
     """Check vector store status"""
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{API_BASE_URL}/vector-store/stats")
-            if response.status_code == 200:
-                stats = response.json()
-                if stats["status"] == "loaded":
-                    return f"🟢 Vector Store: {stats['total_documents']} documents"
-                else:
-                    return "🔴 Vector Store: Not loaded"
+        response = await _client.get("/vector-store/stats", timeout=5.0)
+        if response.status_code == 200:
+            stats = response.json()
+            if stats["status"] == "loaded":
+                return f"🟢 Vector Store: {stats['total_documents']} documents"
             else:
-                return f"🔴 Vector Store Error: {response.status_code}"
+                return "🔴 Vector Store: Not loaded"
+        else:
+            return f"🔴 Vector Store Error: {response.status_code}"
     except Exception as e:
         return f"🔴 Vector Store Offline: {str(e)}"
 
@@ -252,10 +265,10 @@ def create_gradio_interface():
         # Event handlers
         async def handle_send(message, history):
             """Handle send button click"""
-            result = await process_user_message(message, history)
-            # Also update phase info
-            phase_info_text = get_current_phase_info()
-            return result + (phase_info_text,)
+            async for result in process_user_message(message, history):
+                # Also update phase info
+                phase_info_text = get_current_phase_info()
+                yield result + (phase_info_text,)
         
         async def handle_refresh():
             """Handle refresh status button"""
@@ -330,12 +343,20 @@ def main():
     
     demo = create_gradio_interface()
     
-    demo.launch(
-        server_name="0.0.0.0",
-        server_port=7860,
-        share=False,
-        inbrowser=True
-    )
+    try:
+        demo.launch(
+            server_name="0.0.0.0",
+            server_port=7860,
+            share=False,
+            inbrowser=True
+        )
+    finally:
+        # Release pooled API connections once the UI shuts down
+        demo.close()
+        try:
+            asyncio.run(_client.aclose())
+        except Exception as e:
+            print(f"Error closing API client: {e}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,21 @@
+"""
+Gunicorn configuration for serving the FastAPI backend in production.
+
+Usage:
+    gunicorn -c gunicorn_config.py app:app
+"""
+
+import multiprocessing
+import os
+
+# Bind address (same port the Gradio frontend talks to)
+bind = os.getenv("BIND", "0.0.0.0:8000")
+
+# One Uvicorn worker per CPU core by default
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# LLM calls can take a while - don't let Gunicorn kill busy workers
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 import re
@@ -27,6 +27,7 @@ class ChatRequest(BaseModel):
     user_profile: Optional[UserProfile] = Field(None, description="User profile if available")
     conversation_history: List[ChatMessage] = Field(default_factory=list, description="Chat history")
     phase: str = Field(default="onboarding", description="Current phase: onboarding or qa")
+    session_id: Optional[str] = Field(None, description="Conversation ID; with server-side sessions only the new message is sent")
 
 class ChatResponse(BaseModel):
     message: str = Field(..., description="Assistant's response")
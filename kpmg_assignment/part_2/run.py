@@ -3,12 +3,22 @@
 Convenience script to run both backend and frontend services
 """
 
-import subprocess
+import asyncio
 import sys
-import time
 import signal
 import os
-from pathlib import Path
+
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows
+    uvloop = None
+
+def has_index_file(vector_store_path: str) -> bool:
+    """Check whether the vector store folder contains a FAISS index (.bin) file"""
+    if not os.path.isdir(vector_store_path):
+        return False
+    with os.scandir(vector_store_path) as entries:
+        return any(entry.name.endswith(".bin") for entry in entries)
 
 def check_requirements():
     """Check if all requirements are met"""
@@ -21,8 +31,7 @@ def check_requirements():
         return False
     
     # Check if vector store exists
-    vector_store_path = Path("indexes")
-    if not vector_store_path.exists() or not list(vector_store_path.glob("*.bin")):
+    if not has_index_file("indexes"):
         print("❌ Vector store not found!")
         print("🔧 Please run: python scripts/build_index.py")
         return False
@@ -36,77 +45,93 @@ def check_requirements():
     print("✅ All requirements satisfied!")
     return True
 
-def run_backend():
+async def run_backend() -> asyncio.subprocess.Process:
     """Run FastAPI backend"""
     print("🚀 Starting FastAPI backend on http://localhost:8000")
-    return subprocess.Popen([
-        sys.executable, "app.py"
-    ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    return await asyncio.create_subprocess_exec(
+        sys.executable, "app.py",
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
 
-def run_frontend():
+async def run_frontend() -> asyncio.subprocess.Process:
     """Run Gradio frontend"""
     print("🌐 Starting Gradio frontend on http://localhost:7860")
-    return subprocess.Popen([
-        sys.executable, "gradio_ui.py"
-    ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    return await asyncio.create_subprocess_exec(
+        sys.executable, "gradio_ui.py",
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
 
-def main():
-    """Main function"""
-    print("🏥 Medical Services ChatBot - Startup Script")
-    print("=" * 50)
-    
-    # Check requirements
-    if not check_requirements():
-        sys.exit(1)
-    
-    processes = []
+async def forward_output(name: str, process: asyncio.subprocess.Process):
+    """Print a service's output as it is produced, so its pipe never fills up"""
+    async for line in process.stdout:
+        print(f"[{name}] {line.decode(errors='replace').rstrip()}")
+
+async def stop_process(process: asyncio.subprocess.Process):
+    """Terminate a service, killing it if it doesn't exit within 5 seconds"""
+    if process.returncode is not None:
+        return
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), timeout=5)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+async def run_services():
+    """Start both services and wait until one of them exits"""
+    processes = {}
+    output_tasks = []
     
     try:
         # Start backend
-        backend_process = run_backend()
-        processes.append(backend_process)
+        processes["backend"] = await run_backend()
+        output_tasks.append(asyncio.create_task(forward_output("backend", processes["backend"])))
         
         # Wait a moment for backend to start
         print("⏳ Waiting for backend to start...")
-        time.sleep(3)
+        await asyncio.sleep(3)
         
         # Start frontend
-        frontend_process = run_frontend()
-        processes.append(frontend_process)
+        processes["frontend"] = await run_frontend()
+        output_tasks.append(asyncio.create_task(forward_output("frontend", processes["frontend"])))
         
         print("\n🎉 Both services are starting up!")
         print("📊 Backend API: http://localhost:8000")
         print("💬 Frontend UI: http://localhost:7860")
         print("\nPress Ctrl+C to stop both services")
         
-        # Wait for processes
-        while True:
-            # Check if any process has died
-            for i, process in enumerate(processes):
-                if process.poll() is not None:
-                    print(f"\n❌ Process {i} has stopped unexpectedly")
-                    # Read any error output
-                    output, error = process.communicate()
-                    if output:
-                        print(f"Output: {output}")
-                    if error:
-                        print(f"Error: {error}")
-                    raise KeyboardInterrupt()
-            
-            time.sleep(1)
-            
-    except KeyboardInterrupt:
+        # Wait for processes - returns as soon as either one exits
+        wait_tasks = {asyncio.create_task(process.wait()): name for name, process in processes.items()}
+        done, _ = await asyncio.wait(wait_tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            print(f"\n❌ {wait_tasks[task].capitalize()} has stopped unexpectedly (exit code {task.result()})")
+        
+    finally:
         print("\n🛑 Shutting down services...")
         
         # Terminate all processes
-        for process in processes:
-            try:
-                process.terminate()
-                process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                process.kill()
+        await asyncio.gather(*(stop_process(process) for process in processes.values()))
+        for task in output_tasks:
+            task.cancel()
         
         print("✅ All services stopped")
 
+def main():
+    """Main function"""
+    print("🏥 Medical Services ChatBot - Startup Script")
+    print("=" * 50)
+    
+    # Check requirements
+    if not check_requirements():
+        sys.exit(1)
+    
+    if uvloop is not None:
+        uvloop.install()
+    
+    try:
+        asyncio.run(run_services())
+    except KeyboardInterrupt:
+        pass
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -4,56 +4,203 @@ Script to build FAISS index from HTML files in phase2_data folder
 """
 
 import os
-import pickle
+import re
+import math
+import json
+import sqlite3
+import hashlib
 import sys
 import faiss
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from bs4 import BeautifulSoup
-from langchain_openai import AzureOpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from dotenv import load_dotenv
 
 # Add parent directory to path to import models
 sys.path.append(str(Path(__file__).parent.parent))
 
+from services.embeddings_pool import create_embeddings
+from services.hmo import normalize_hmo
+
 # Load environment variables
 load_dotenv()
 
+# Runs of whitespace (including newlines) collapsed to a single space in extracted text
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def _clean_text(text: str) -> str:
+    """Collapse runs of whitespace to single spaces and strip the ends"""
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+# Number of texts sent in each embeddings request, and number of requests in flight
+EMBEDDING_BATCH_SIZE = 1000
+EMBEDDING_WORKERS = 8
+
+# FAISS index layout: "hnsw" (default) or "ivf" for very large corpora (beyond ~100k chunks)
+INDEX_TYPE = os.getenv("INDEX_TYPE", "hnsw").lower()
+
+# FAISS index layout and HNSW graph parameters (efSearch is saved with the index).
+# Vectors are stored as 8-bit scalar-quantized codes (1/4 of the float32 size).
+INDEX_FACTORY = "HNSW32,SQ8"
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# IVF layout: inverted lists formatted with the list count, trained on a sample of
+# this many vectors per list (nprobe is saved with the index)
+IVF_INDEX_FACTORY = "IVF{nlist},SQ8"
+IVF_TRAINING_POINTS_PER_LIST = 50
+
+# Per-file cache of chunks and embeddings, written next to the index
+CHUNK_CACHE_FILENAME = "chunks_cache.sqlite"
+# Version of the cached chunk layout; caches written by other versions are discarded
+CHUNK_CACHE_VERSION = 2
+
+# A loaded HTML file: (file_path, mtime, size, first chunk row, end chunk row, cached embeddings or None)
+SourceFile = Tuple[str, float, int, int, int, Optional[np.ndarray]]
+
+# Text splitter of the current (worker) process, created on first use
+_text_splitter: Optional[RecursiveCharacterTextSplitter] = None
+
+def _get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """Get the process-wide RecursiveCharacterTextSplitter"""
+    global _text_splitter
+    if _text_splitter is None:
+        _text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200,
+            length_function=len
+        )
+    return _text_splitter
+
+def _parse_and_split(html_file: str) -> tuple[List[str], List[Dict[str, Any]]]:
+    """Extract the text of an HTML file and split it into chunks (runs in a worker process)
+    
+    Args:
+        html_file: Path to the HTML file
+        
+    Returns:
+        tuple[List[str], List[Dict[str, Any]]]: Tuple containing the chunks and their metadata
+    """
+    documents = []
+    metadata_list = []
+    
+    # Extract the general and per-HMO sections of the HTML file, and split each into chunks
+    # (so no chunk mixes HMOs and every chunk carries a single HMO tag)
+    for text, metadata in IndexBuilder.extract_sections_from_html(html_file):
+        for chunk in _get_text_splitter().split_text(text):
+            if chunk.strip():
+                documents.append(chunk)
+                chunk_metadata = metadata.copy()
+                chunk_metadata["chunk_id"] = len(documents) - 1
+                metadata_list.append(chunk_metadata)
+    
+    # Chunk ids are numbered across the file's sections
+    for chunk_metadata in metadata_list:
+        chunk_metadata["total_chunks"] = len(documents)
+    
+    return documents, metadata_list
+
+class ChunkCache:
+    """SQLite cache of each HTML file's chunks, metadata and embeddings, valid while the file's mtime and size are unchanged"""
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        # Chunks of an older layout (e.g. without HMO tags) must be re-parsed, not reused
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != CHUNK_CACHE_VERSION:
+            with self.conn:
+                self.conn.execute("DROP TABLE IF EXISTS chunks")
+                self.conn.execute(f"PRAGMA user_version = {CHUNK_CACHE_VERSION}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks "
+            "(file_path TEXT PRIMARY KEY, mtime REAL, size INT, chunks_json BLOB, emb BLOB)"
+        )
+    
+    def get(self, file_path: str, mtime: float, size: int) -> Optional[tuple[List[str], List[Dict[str, Any]], np.ndarray]]:
+        """Get the cached chunks, metadata and embeddings of a file
+        
+        Args:
+            file_path: Path to the HTML file
+            mtime: Current modification time of the file
+            size: Current size of the file in bytes
+            
+        Returns:
+            Optional[tuple[List[str], List[Dict[str, Any]], np.ndarray]]: The cached entry, or None if the
+            file is not cached or has changed since
+        """
+        row = self.conn.execute(
+            "SELECT chunks_json, emb FROM chunks WHERE file_path = ? AND mtime = ? AND size = ?",
+            (file_path, mtime, size)
+        ).fetchone()
+        if row is None:
+            return None
+        
+        cached = json.loads(row[0])
+        chunks = cached["chunks"]
+        embeddings = np.frombuffer(row[1], dtype=np.float32).reshape(len(chunks), -1)
+        return chunks, cached["metadata"], embeddings
+    
+    def put(self, file_path: str, mtime: float, size: int, chunks: List[str],
+            metadata_list: List[Dict[str, Any]], embeddings: np.ndarray):
+        """Cache the chunks, metadata and embeddings of a file
+        
+        Args:
+            file_path: Path to the HTML file
+            mtime: Modification time of the file when it was parsed
+            size: Size of the file in bytes when it was parsed
+            chunks: The file's chunks
+            metadata_list: Metadata of each chunk
+            embeddings: float32 embeddings of each chunk
+        """
+        chunks_json = json.dumps({"chunks": chunks, "metadata": metadata_list}).encode('utf-8')
+        emb = np.ascontiguousarray(embeddings, dtype=np.float32).tobytes()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)",
+                (file_path, mtime, size, chunks_json, emb)
+            )
+    
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
+
 class IndexBuilder:
     """Class to build FAISS index from HTML files"""
     def __init__(self, data_folder: str = "phase2_data", vector_store_path: str = "part_2/indexes"):
         self.data_folder = data_folder
         self.vector_store_path = vector_store_path
-        # Use Azure OpenAI embeddings
-        self.embeddings = AzureOpenAIEmbeddings(
-            azure_deployment="text-embedding-3-small",
-            api_version="2024-12-01-preview"
-        )
-        # Use RecursiveCharacterTextSplitter to split text into chunks
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
+        # Cache of unchanged files' chunks and embeddings (opened by build_index)
+        self.chunk_cache: Optional[ChunkCache] = None
+        # Use Azure OpenAI embeddings over the shared connection pool
+        self.embeddings = create_embeddings(
+            chunk_size=EMBEDDING_BATCH_SIZE,
+            max_retries=6
         )
         
-    def extract_text_from_html(self, html_file: str) -> tuple[str, Dict[str, Any]]:
-        """Extract text content from HTML file
+    @staticmethod
+    def extract_sections_from_html(html_file: str) -> List[tuple[str, Dict[str, Any]]]:
+        """Extract the text content of an HTML file, partitioned by the HMO it applies to
+        
+        Table columns headed by an HMO and list items that start with an HMO name (e.g. "מכבי: ...")
+        go to that HMO's section; the rest of the page is general text that applies to every HMO.
         
         Args:
             html_file: Path to the HTML file
             
         Returns:
-            tuple[str, Dict[str, Any]]: Tuple containing the text content and metadata
+            List[tuple[str, Dict[str, Any]]]: (text, metadata) of each non-empty section, where
+            metadata["hmo"] is the canonical HMO name, or "" for the general section
         """
         try:
             # Read HTML file
             with open(html_file, 'r', encoding='utf-8') as f:
                 html_content = f.read()
             
-            # Parse HTML content with BeautifulSoup
-            soup = BeautifulSoup(html_content, 'html.parser')
+            # Parse HTML content with BeautifulSoup (C-backed lxml parser)
+            soup = BeautifulSoup(html_content, 'lxml')
             
             # Extract title
             title = soup.find('title')
@@ -63,13 +210,50 @@ class IndexBuilder:
             for script in soup(["script", "style"]):
                 script.decompose()
             
-            # Extract text content
-            text = soup.get_text()
+            # The page heading names the service; it prefixes each HMO section so its chunks stand alone
+            heading = soup.find(['h1', 'h2'])
+            heading_text = _clean_text(heading.get_text(separator=' ')) if heading else title_text
+            
+            # Canonical HMO -> (name as written on the page, lines of that HMO's section)
+            hmo_sections: Dict[str, tuple[str, List[str]]] = {}
+            
+            # Tables with a column per HMO: one "<service>: <benefits>" line per row and HMO
+            for table in soup.find_all('table'):
+                rows = table.find_all('tr')
+                header_cells = rows[0].find_all(['th', 'td']) if rows else []
+                hmos = [normalize_hmo(cell.get_text()) for cell in header_cells]
+                if not any(hmos):
+                    continue
+                
+                for row in rows[1:]:
+                    cells = row.find_all(['th', 'td'])
+                    if not cells:
+                        continue
+                    service = _clean_text(cells[0].get_text(separator=' '))
+                    for hmo, header_cell, cell in zip(hmos, header_cells, cells):
+                        if hmo:
+                            name = _clean_text(header_cell.get_text())
+                            hmo_sections.setdefault(hmo, (name, []))[1].append(
+                                f"{service}: {_clean_text(cell.get_text(separator=' '))}"
+                            )
+                table.decompose()
+            
+            # List items naming an HMO (e.g. phone numbers), prefixed with their sub-heading
+            for item in soup.find_all('li'):
+                item_text = _clean_text(item.get_text(separator=' '))
+                label, separator, _ = item_text.partition(':')
+                hmo = normalize_hmo(label) if separator else ""
+                if not hmo:
+                    continue
+                
+                sub_heading = item.find_previous(['h2', 'h3'])
+                sub_heading_text = _clean_text(sub_heading.get_text(separator=' ')) if sub_heading else ""
+                hmo_sections.setdefault(hmo, (label, []))[1].append(f"{sub_heading_text} {item_text}".strip())
+                item.decompose()
             
-            # Clean up text
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = ' '.join(chunk for chunk in chunks if chunk)
+            # Extract the remaining (general) text and collapse whitespace in one regex pass
+            # (separate text nodes with a space so words in adjacent tags don't run together)
+            text = _clean_text(soup.get_text(separator=' '))
             
             # Extract metadata
             filename = os.path.basename(html_file)
@@ -79,65 +263,227 @@ class IndexBuilder:
                 "file_path": html_file
             }
             
-            return text, metadata
+            sections = [(text, {**metadata, "hmo": ""})] if text else []
+            for hmo, (name, lines) in hmo_sections.items():
+                section_text = "\n".join([f"{heading_text} - {name}", *lines])
+                sections.append((section_text, {**metadata, "hmo": hmo}))
+            return sections
             
         except Exception as e:
             print(f"Error processing {html_file}: {e}")
-            return "", {}
+            return []
     
-    def load_documents(self) -> tuple[List[str], List[Dict[str, Any]]]:
-        """Load and process all HTML documents
+    def load_documents(self) -> tuple[List[str], List[Dict[str, Any]], List[SourceFile]]:
+        """Load and process all HTML documents, reusing cached chunks of unchanged files
         
         Returns:
-            tuple[List[str], List[Dict[str, Any]]]: Tuple containing the list of documents and metadata
+            tuple[List[str], List[Dict[str, Any]], List[SourceFile]]: Tuple containing the list of documents,
+            metadata, and the files the documents came from (with their cached embeddings, if any)
         """
         documents = []
         metadata_list = []
+        source_files: List[SourceFile] = []
         
         # Check if data folder exists
         if not os.path.exists(self.data_folder):
             print(f"Data folder {self.data_folder} not found.")
-            return documents, metadata_list
+            return documents, metadata_list, source_files
         
         # Get all HTML files in data folder
-        html_files = list(Path(self.data_folder).glob("*.html"))
+        with os.scandir(self.data_folder) as entries:
+            html_files = [
+                entry.path for entry in entries
+                if entry.name.endswith(".html") and entry.is_file(follow_symlinks=False)
+            ]
         
         # Check if there are any HTML files
         if not html_files:
             print(f"No HTML files found in {self.data_folder}")
-            return documents, metadata_list
+            return documents, metadata_list, source_files
         
         print(f"Found {len(html_files)} HTML files")
         
-        # Process each HTML file
+        # Reuse the chunks and embeddings of files that haven't changed since the last build
+        file_stats = {html_file: os.stat(html_file) for html_file in html_files}
+        cached_files = {}
+        if self.chunk_cache is not None:
+            for html_file, stat in file_stats.items():
+                cached = self.chunk_cache.get(html_file, stat.st_mtime, stat.st_size)
+                if cached is not None:
+                    cached_files[html_file] = cached
+        changed_files = [html_file for html_file in html_files if html_file not in cached_files]
+        print(f"Reusing {len(cached_files)} cached files, processing {len(changed_files)}")
+        
+        # Parse and split the new or changed HTML files in parallel worker processes
+        parsed_files = {}
+        if changed_files:
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+                for html_file, parsed in zip(
+                    changed_files, executor.map(_parse_and_split, changed_files, chunksize=4)
+                ):
+                    print(f"Processed {html_file}")
+                    parsed_files[html_file] = parsed
+        
+        # Collect the chunks in file order
         for html_file in html_files:
-            print(f"Processing {html_file}")
-            # Extract text content and metadata from HTML file
-            text, metadata = self.extract_text_from_html(str(html_file))
-            
-            # Check if text content is not empty
-            if text.strip():
-                # Split text into chunks using RecursiveCharacterTextSplitter
-                chunks = self.text_splitter.split_text(text)
-                
-                # Add each chunk to the documents list and metadata list
-                for i, chunk in enumerate(chunks):
-                    if chunk.strip():
-                        documents.append(chunk)
-                        chunk_metadata = metadata.copy()
-                        chunk_metadata["chunk_id"] = i
-                        chunk_metadata["total_chunks"] = len(chunks)
-                        metadata_list.append(chunk_metadata)
+            if html_file in cached_files:
+                chunks, chunk_metadata, embeddings = cached_files[html_file]
+            else:
+                chunks, chunk_metadata = parsed_files[html_file]
+                embeddings = None
+            
+            if chunks:
+                stat = file_stats[html_file]
+                source_files.append((
+                    html_file, stat.st_mtime, stat.st_size,
+                    len(documents), len(documents) + len(chunks), embeddings
+                ))
+                documents.extend(chunks)
+                metadata_list.extend(chunk_metadata)
             else:
                 print(f"No text extracted from {html_file}")
         
         print(f"Total document chunks: {len(documents)}")
-        return documents, metadata_list
+        return documents, metadata_list, source_files
+    
+    @staticmethod
+    def deduplicate_documents(documents: List[str]) -> tuple[List[str], np.ndarray]:
+        """Collapse repeated chunks (e.g. navigation and footer boilerplate) before embedding
+        
+        Args:
+            documents: The document chunks
+            
+        Returns:
+            tuple[List[str], np.ndarray]: The unique chunks, and for each input chunk the row
+            of its unique chunk (so unique_embeddings[rows] gives one embedding per input chunk)
+        """
+        seen: Dict[bytes, int] = {}
+        unique_documents = []
+        rows = np.empty(len(documents), dtype=np.int64)
+        
+        for i, doc in enumerate(documents):
+            digest = hashlib.blake2b(doc.encode('utf-8'), digest_size=16).digest()
+            row = seen.get(digest)
+            if row is None:
+                row = seen[digest] = len(unique_documents)
+                unique_documents.append(doc)
+            rows[i] = row
+        
+        return unique_documents, rows
+    
+    def embed_documents(self, documents: List[str]) -> np.ndarray:
+        """Generate embeddings with concurrent batched requests
+        
+        Args:
+            documents: The texts to embed
+            
+        Returns:
+            np.ndarray: float32 array of shape (len(documents), dimension), in document order
+        """
+        embeddings_array = None
+        
+        with ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS) as executor:
+            # Each batch is a single embeddings request; remember its offset in the output
+            futures = {
+                executor.submit(self.embeddings.embed_documents, documents[start:start + EMBEDDING_BATCH_SIZE]): start
+                for start in range(0, len(documents), EMBEDDING_BATCH_SIZE)
+            }
+            
+            for future in as_completed(futures):
+                start = futures[future]
+                batch = np.asarray(future.result(), dtype=np.float32)
+                # Allocate the output once the dimension is known, then write batches in place
+                if embeddings_array is None:
+                    embeddings_array = np.empty((len(documents), batch.shape[1]), dtype=np.float32)
+                embeddings_array[start:start + len(batch)] = batch
+        
+        return embeddings_array
+    
+    @staticmethod
+    def create_ivf_index(embeddings_array: np.ndarray) -> faiss.Index:
+        """Create and train an IVF index, which only scans the nprobe closest lists per query
+        
+        Args:
+            embeddings_array: Normalized embeddings the index will hold
+            
+        Returns:
+            faiss.Index: Trained (still empty) IVF index with Inner Product (cosine similarity)
+        """
+        num_vectors, dimension = embeddings_array.shape
+        # About 4 * sqrt(N) lists, but never more lists than vectors to train them on
+        nlist = min(max(64, int(4 * math.sqrt(num_vectors))), num_vectors)
+        index = faiss.index_factory(dimension, IVF_INDEX_FACTORY.format(nlist=nlist), faiss.METRIC_INNER_PRODUCT)
+        
+        # Train the k-means centroids (and scalar quantizer) on a uniform sample
+        sample_size = min(num_vectors, IVF_TRAINING_POINTS_PER_LIST * nlist)
+        sample = embeddings_array[np.random.choice(num_vectors, sample_size, replace=False)]
+        index.train(sample) # type: ignore
+        
+        index.nprobe = max(8, nlist // 16)
+        return index
+    
+    def embed_source_files(self, documents: List[str], metadata_list: List[Dict[str, Any]],
+                           source_files: List[SourceFile]) -> np.ndarray:
+        """Embed the chunks of new or changed files and combine them with the cached embeddings
+        
+        Args:
+            documents: All document chunks
+            metadata_list: Metadata of each chunk
+            source_files: The files the chunks came from, as returned by load_documents
+            
+        Returns:
+            np.ndarray: float32 array of shape (len(documents), dimension), in document order
+        """
+        # Rows of the chunks that have no cached embedding
+        new_rows = [
+            row for _, _, _, start, end, embeddings in source_files if embeddings is None
+            for row in range(start, end)
+        ]
+        
+        new_embeddings = None
+        if new_rows:
+            # Only embed each distinct chunk once
+            unique_documents, rows = self.deduplicate_documents([documents[row] for row in new_rows])
+            print(f"Embedding {len(unique_documents)} unique chunks of {len(new_rows)} new chunks")
+            
+            # Generate embeddings for each unique chunk, then expand back to one row per chunk
+            # (skip the gather copy when there were no duplicates)
+            new_embeddings = self.embed_documents(unique_documents)
+            if len(unique_documents) < len(new_rows):
+                new_embeddings = new_embeddings[rows]
+        
+        # Write cached and new embeddings into one array, caching the new ones per file
+        if new_embeddings is not None:
+            dimension = new_embeddings.shape[1]
+        else:
+            dimension = source_files[0][5].shape[1]
+        embeddings_array = np.empty((len(documents), dimension), dtype=np.float32)
+        offset = 0
+        for file_path, mtime, size, start, end, embeddings in source_files:
+            if embeddings is None:
+                embeddings = new_embeddings[offset:offset + end - start]
+                offset += end - start
+                if self.chunk_cache is not None:
+                    self.chunk_cache.put(file_path, mtime, size, documents[start:end], metadata_list[start:end], embeddings)
+            embeddings_array[start:end] = embeddings
+        
+        return embeddings_array
     
     def build_index(self):
         """Build FAISS index from documents"""
+        # Open the cache of previously parsed and embedded files
+        os.makedirs(self.vector_store_path, exist_ok=True)
+        self.chunk_cache = ChunkCache(os.path.join(self.vector_store_path, CHUNK_CACHE_FILENAME))
+        try:
+            self._build_index()
+        finally:
+            self.chunk_cache.close()
+            self.chunk_cache = None
+    
+    def _build_index(self):
+        """Build FAISS index from documents (with the chunk cache open)"""
         print("Loading documents...")
-        documents, metadata_list = self.load_documents()
+        documents, metadata_list, source_files = self.load_documents()
         
         if not documents:
             print("No documents to index.")
@@ -145,49 +491,57 @@ class IndexBuilder:
         
         print("Generating embeddings...")
         try:
-            # Generate embeddings for each document
-            embeddings_list = self.embeddings.embed_documents(documents)
-            # Convert embeddings to numpy array
-            embeddings_array = np.array(embeddings_list, dtype=np.float32)
+            # Generate embeddings for each new chunk, reusing those of unchanged files
+            embeddings_array = self.embed_source_files(documents, metadata_list, source_files)
         except Exception as e:
             print(f"Error generating embeddings: {e}")
             return
         
         print(f"Embeddings shape: {embeddings_array.shape}")
         
+        # Normalize embeddings for cosine similarity (FAISS needs C-contiguous float32 to avoid a copy)
+        embeddings_array = np.ascontiguousarray(embeddings_array, dtype=np.float32)
+        faiss.normalize_L2(embeddings_array)
+        
         # Create FAISS index
         dimension = embeddings_array.shape[1]
-        # Create FAISS index with Inner Product (cosine similarity)
-        index = faiss.IndexFlatIP(dimension)
-        
-        # Normalize embeddings for cosine similarity
-        faiss.normalize_L2(embeddings_array)
+        if INDEX_TYPE == "ivf":
+            index = self.create_ivf_index(embeddings_array)
+        else:
+            # Create HNSW FAISS index with Inner Product (cosine similarity)
+            index = faiss.index_factory(dimension, INDEX_FACTORY, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+            # Train the scalar quantizer on the data range
+            index.train(embeddings_array) # type: ignore
         
         # Add embeddings to index
         index.add(embeddings_array) # type: ignore
         
         print(f"Created FAISS index with {index.ntotal} documents")
         
-        # Create vector store directory
-        os.makedirs(self.vector_store_path, exist_ok=True)
-        
         # Create paths for index, documents, and metadata
         index_path = os.path.join(self.vector_store_path, "faiss_index.bin")
-        docs_path = os.path.join(self.vector_store_path, "documents.pkl")
-        metadata_path = os.path.join(self.vector_store_path, "metadata.pkl")
+        docs_path = os.path.join(self.vector_store_path, "documents.bin")
+        offsets_path = os.path.join(self.vector_store_path, "documents.idx")
+        metadata_path = os.path.join(self.vector_store_path, "metadata.parquet")
         
         print("Saving index and metadata...")
         
         # Save index
         faiss.write_index(index, index_path)
         
-        # Save documents
+        # Save documents as one UTF-8 blob plus byte offsets (memory-mapped by VectorService)
+        encoded_documents = [doc.encode('utf-8') for doc in documents]
+        offsets = np.zeros(len(encoded_documents) + 1, dtype=np.int64)
+        np.cumsum([len(doc) for doc in encoded_documents], out=offsets[1:])
         with open(docs_path, 'wb') as f:
-            pickle.dump(documents, f)
+            f.write(b"".join(encoded_documents))
+        with open(offsets_path, 'wb') as f:
+            np.save(f, offsets)
         
-        # Save metadata
-        with open(metadata_path, 'wb') as f:
-            pickle.dump(metadata_list, f)
+        # Save metadata as a Parquet table
+        pq.write_table(pa.Table.from_pylist(metadata_list), metadata_path)
         
         print(f"Index saved to {self.vector_store_path}")
         
@@ -1,10 +1,11 @@
 from services.vector_service import VectorService
+from services.hmo import normalize_hmo
 from typing import Annotated, Optional
 from langchain_core.tools import tool
 from langgraph.types import Command
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import InjectedState
-from langchain_core.tools import InjectedToolCallId
+from langchain_core.tools import InjectedToolCallId, InjectedToolArg
 from langchain_core.messages import BaseMessage
 from typing import List
 from typing_extensions import TypedDict
@@ -23,6 +24,8 @@ class MessagesState(TypedDict):
 class WorkflowState(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages]
     user_profile: Optional[UserProfile]
+    transcript: str
+    transcript_length: int
 
 def load_prompt_from_file(filename: str) -> str:
     """Load prompt content from a file"""
@@ -38,6 +41,23 @@ def load_prompt_from_file(filename: str) -> str:
 
 def create_extract_user_info_tool(llm: AzureChatOpenAI):
     """Create the extract_user_info tool"""
+    if llm is None:
+        raise ValueError("LLM is required for user information extraction")
+    
+    # Build the extraction chain once, when the tool is created (not on every call)
+    info_extraction_prompt_content = load_prompt_from_file("info_extraction.txt")
+    
+    # Create prompt template
+    extraction_prompt = ChatPromptTemplate.from_messages([
+        ("system", info_extraction_prompt_content),
+        ("user", "<chat_history>{conversation_history}</chat_history>")
+    ])
+    
+    # Create LLM with structured output for UserProfile
+    structured_llm = llm.with_structured_output(UserProfile)
+    
+    # Chain the prompt with the structured LLM
+    extraction_chain = extraction_prompt | structured_llm
     
     @tool
     def extract_user_info(
@@ -53,24 +73,6 @@ def create_extract_user_info_tool(llm: AzureChatOpenAI):
             str: JSON string containing the extracted user profile
         """
         try:
-            if llm is None:
-                raise ValueError("LLM is required for user information extraction")
-                
-            # Load the extraction prompt
-            info_extraction_prompt_content = load_prompt_from_file("info_extraction.txt")
-            
-            # Create prompt template
-            extraction_prompt = ChatPromptTemplate.from_messages([
-                ("system", info_extraction_prompt_content),
-                ("user", "<chat_history>{conversation_history}</chat_history>")
-            ])
-            
-            # Create LLM with structured output for UserProfile
-            structured_llm = llm.with_structured_output(UserProfile)
-            
-            # Chain the prompt with the structured LLM
-            extraction_chain = extraction_prompt | structured_llm
-            
             # Extract the user profile from the conversation
             extracted_result = extraction_chain.invoke({"conversation_history": conversation_history})
 
@@ -97,18 +99,22 @@ def create_search_info_tool(vector_service: VectorService):
     
     @tool
     def search_info(
-        question: Annotated[str, "Any question about HMO services that the information to answer it is not available in chat history"]
+        question: Annotated[str, "Any question about HMO services that the information to answer it is not available in chat history"],
+        hmo: Annotated[str, InjectedToolArg] = ""
     ) -> str:
         """
         Use vector similarity search to retrieve HMO-services-related information from the knowledge base.
 
         Args:
             question (str): Natural language question from the user.
+            hmo (str): The user's HMO as collected in onboarding (e.g. "מכבי"), filled in by the workflow
+                from the user profile (not by the LLM).
 
         Returns:
             str: Relevant document excerpts from the HMO services knowledge base.
         """
-        results = vector_service.search(question)
+        # Map the HMO to the canonical name the index metadata is tagged with
+        results = vector_service.search(question, hmo_filter=normalize_hmo(hmo))
         
         # Convert RetrievalResult list to string format
         if not results:
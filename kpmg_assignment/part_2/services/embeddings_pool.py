@@ -0,0 +1,42 @@
+import httpx
+from functools import lru_cache
+from typing import Any
+from langchain_openai import AzureOpenAIEmbeddings
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Connection pool limits of the HTTP clients shared by every embeddings client in the process
+EMBEDDINGS_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+
+# One sync and one async HTTP client per process, so embedding requests reuse warm TLS connections
+http_client = httpx.Client(limits=EMBEDDINGS_HTTP_LIMITS)
+http_async_client = httpx.AsyncClient(limits=EMBEDDINGS_HTTP_LIMITS)
+
+def create_embeddings(**kwargs: Any) -> AzureOpenAIEmbeddings:
+    """Create an Azure OpenAI embeddings client on top of the shared connection pools
+
+    Args:
+        **kwargs: Extra AzureOpenAIEmbeddings settings (e.g. chunk_size, max_retries)
+
+    Returns:
+        AzureOpenAIEmbeddings: Embeddings client for text-embedding-3-small
+    """
+    return AzureOpenAIEmbeddings(
+        azure_deployment="text-embedding-3-small",
+        api_version="2024-12-01-preview",
+        http_client=http_client,
+        http_async_client=http_async_client,
+        **kwargs
+    )
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> AzureOpenAIEmbeddings:
+    """Get the process-wide embeddings client (created on first use)"""
+    return create_embeddings()
+
+async def aclose():
+    """Close the shared HTTP clients (call on application shutdown)"""
+    await http_async_client.aclose()
+    http_client.close()
@@ -0,0 +1,37 @@
+import re
+from typing import Optional
+
+# Canonical HMO name of every spelling used by users and the knowledge base (Hebrew and English)
+HMO_ALIASES = {
+    "maccabi": "maccabi",
+    "makabi": "maccabi",
+    "מכבי": "maccabi",
+    "clalit": "clalit",
+    "klalit": "clalit",
+    "כללית": "clalit",
+    "meuhedet": "meuhedet",
+    "meuchedet": "meuhedet",
+    "מאוחדת": "meuhedet",
+}
+
+# An alias as a whole word, optionally with a Hebrew prefix letter (e.g. "במכבי"), but not "מכביה"
+_HMO_ALIAS_RE = re.compile(
+    r"(?<!\w)[בהולמש]?(" + "|".join(sorted(map(re.escape, HMO_ALIASES), key=len, reverse=True)) + r")(?!\w)"
+)
+
+def normalize_hmo(value: Optional[str]) -> str:
+    """Map an HMO name to its canonical name, as stored in the index metadata
+
+    Args:
+        value: HMO name in Hebrew or English (e.g. "מכבי", "Maccabi", "קופת חולים מכבי")
+
+    Returns:
+        str: "maccabi", "clalit" or "meuhedet", or "" if no single HMO is named
+    """
+    if not value:
+        return ""
+    value = value.strip().strip("\"'״׳:").lower()
+    if value in HMO_ALIASES:
+        return HMO_ALIASES[value]
+    names = {HMO_ALIASES[alias] for alias in _HMO_ALIAS_RE.findall(value)}
+    return names.pop() if len(names) == 1 else ""
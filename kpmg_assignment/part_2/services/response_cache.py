@@ -0,0 +1,131 @@
+import hashlib
+import faiss
+import numpy as np
+from typing import List, Optional, Tuple
+from cachetools import TTLCache
+from langchain_openai import AzureOpenAIEmbeddings
+
+# Questions shorter than this are usually confirmations or follow-ups ("yes", "and dental?")
+MIN_CACHEABLE_WORDS = 4
+
+# Openers of follow-up questions whose meaning depends on the previous turns (English and Hebrew)
+FOLLOW_UP_PREFIXES = (
+    "and ", "what about", "how about", "also", "same ", "what if",
+    "ומה", "ואיך", "וכמה", "ואם", "ומי", "מה לגבי", "גם ", "ואני"
+)
+
+class ResponseCache:
+    """Two-tier cache for Q&A responses: exact match first, then semantic match"""
+    def __init__(self, embeddings: AzureOpenAIEmbeddings, maxsize: int = 10_000,
+                 ttl: int = 3600, similarity_threshold: float = 0.95):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        # Exact-match tier: key -> response message (entries expire after ttl seconds)
+        self.responses = TTLCache(maxsize=maxsize, ttl=ttl)
+        # Semantic tier: embeddings of cached questions, row i belongs to self.keys[i]
+        self.maxsize = maxsize
+        self.index = None
+        self.keys: List[Tuple[str, str]] = []
+
+    @staticmethod
+    def _normalize(message: str) -> str:
+        """Lowercase and collapse whitespace so trivial variations share a key"""
+        return " ".join(message.lower().split())
+
+    @staticmethod
+    def _partition(hmo: str, insurance_tier: str) -> str:
+        """Answers are only shared between users of the same HMO and tier"""
+        return f"{hmo.lower()}\x1f{insurance_tier.lower()}"
+
+    def is_cacheable(self, message: str) -> bool:
+        """Whether a question can be answered without the conversation's context
+
+        Only standalone questions are shared between users; short confirmations and
+        follow-ups that refer to earlier turns are always sent to the workflow.
+        """
+        normalized = self._normalize(message)
+        if len(normalized.split()) < MIN_CACHEABLE_WORDS:
+            return False
+        return not normalized.startswith(FOLLOW_UP_PREFIXES)
+
+    @staticmethod
+    def is_shareable(response: str, personal_details: List[str]) -> bool:
+        """Whether a response is free of the asking user's personal details (e.g. their name)"""
+        lowered = response.lower()
+        return not any(detail and detail.lower() in lowered for detail in personal_details)
+
+    def _make_key(self, hmo: str, insurance_tier: str, message: str) -> str:
+        """Build the exact-match key for a question asked under a given HMO and tier"""
+        raw = f"{self._partition(hmo, insurance_tier)}\x1f{message}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def _embed(self, message: str) -> np.ndarray:
+        """Embed a message as a normalized row vector"""
+        vector = np.array([await self.embeddings.aembed_query(message)], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+
+    async def lookup(self, hmo: str, insurance_tier: str, message: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Look up a cached response for a question
+
+        Args:
+            hmo: The user's HMO
+            insurance_tier: The user's insurance tier
+            message: The user's question
+
+        Returns:
+            Tuple[Optional[str], Optional[np.ndarray]]: The cached response (or None) and the
+            question embedding, which can be passed to store() to avoid embedding it twice
+        """
+        normalized = self._normalize(message)
+        key = self._make_key(hmo, insurance_tier, normalized)
+
+        # Exact match
+        response = self.responses.get(key)
+        if response is not None:
+            return response, None
+
+        # Semantic match
+        vector = await self._embed(normalized)
+        if self.index is None or self.index.ntotal == 0:
+            return None, vector
+
+        partition = self._partition(hmo, insurance_tier)
+        scores, rows = self.index.search(vector, min(5, self.index.ntotal))
+        for score, row in zip(scores[0], rows[0]):
+            if score < self.similarity_threshold:
+                break
+            cached_partition, cached_key = self.keys[row]
+            if cached_partition != partition:
+                continue
+            response = self.responses.get(cached_key)
+            if response is not None:
+                return response, vector
+
+        return None, vector
+
+    async def store(self, hmo: str, insurance_tier: str, message: str, response: str,
+                    vector: Optional[np.ndarray] = None):
+        """Cache a response for a question
+
+        Args:
+            hmo: The user's HMO
+            insurance_tier: The user's insurance tier
+            message: The user's question
+            response: The response to cache
+            vector: The question embedding returned by lookup(), if available
+        """
+        normalized = self._normalize(message)
+        key = self._make_key(hmo, insurance_tier, normalized)
+        self.responses[key] = response
+
+        if vector is None:
+            vector = await self._embed(normalized)
+
+        # Start a fresh semantic index once it is full; older entries are still served by exact match
+        if self.index is None or self.index.ntotal >= self.maxsize:
+            self.index = faiss.IndexFlatIP(vector.shape[1])
+            self.keys = []
+
+        self.index.add(vector)
+        self.keys.append((self._partition(hmo, insurance_tier), key))
@@ -1,50 +1,137 @@
 import os
+import mmap
 import pickle
+import queue
+import threading
+import time
+import asyncio
 import faiss
 import numpy as np
-from typing import List, Dict, Any
-from langchain_openai import AzureOpenAIEmbeddings
+import pyarrow.parquet as pq
+from cachetools import LRUCache
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Tuple
 from models.schemas import RetrievalResult
+from services.embeddings_pool import get_embeddings
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Concurrent searches are embedded and searched together: up to this many queries,
+# collected for at most this many seconds after the first one arrives
+SEARCH_BATCH_SIZE = 32
+SEARCH_BATCH_WINDOW = 0.02
+
+# Number of query embeddings kept in memory, keyed by normalized query text
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+
+# GPU indexes don't support ID selectors, so HMO-filtered searches on GPU fetch extra hits and
+# filter them on CPU: k is scaled by this factor times the inverse share of matching documents,
+# up to the largest k FAISS GPU indexes can return
+GPU_FILTER_OVERSAMPLING = 2
+GPU_MAX_K = 2048
+
+# A queued search: (query, k, hmo_filter, future resolved with its results)
+SearchRequest = Tuple[str, int, str, Future]
+
+class MappedDocuments:
+    """Read-only list of documents stored as one memory-mapped UTF-8 blob plus byte offsets"""
+    def __init__(self, blob_path: str, offsets_path: str):
+        # offsets[i]:offsets[i + 1] is the byte range of document i
+        self.offsets = np.load(offsets_path)
+        with open(blob_path, 'rb') as f:
+            self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+    
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, idx: int) -> str:
+        return self.blob[self.offsets[idx]:self.offsets[idx + 1]].decode('utf-8')
+
+class ParquetMetadata:
+    """Read-only list of metadata dicts backed by a memory-mapped Parquet table"""
+    def __init__(self, path: str):
+        self.table = pq.read_table(path, memory_map=True)
+    
+    def __len__(self) -> int:
+        return self.table.num_rows
+    
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        return self.table.slice(int(idx), 1).to_pylist()[0]
+    
+    def column(self, name: str) -> List[Any]:
+        """Get one metadata field of every row (None where the table has no such column)"""
+        if name not in self.table.column_names:
+            return [None] * self.table.num_rows
+        return self.table.column(name).to_pylist()
+
 class VectorService:
     """Service to handle vector store operations"""
     def __init__(self, vector_store_path: str = "part_2/indexes"):
         self.vector_store_path = vector_store_path
-        # Use Azure OpenAI embeddings
-        self.embeddings = AzureOpenAIEmbeddings(
-            azure_deployment="text-embedding-3-small",
-            api_version="2024-12-01-preview"
-        )
+        # Use the process-wide Azure OpenAI embeddings client (shared connection pool)
+        self.embeddings = get_embeddings()
         # Load FAISS index and associated data
         self.index = None
         self.documents = None
         self.metadata = None
+        self.gpu_resources = None
+        # Lowercase HMO of each document, used to build HMO filters without touching metadata rows
+        self._hmo_column = np.array([], dtype=str)
+        # HMO filter -> boolean mask of the matching documents (None when it matches all of them)
+        self._hmo_masks: Dict[str, Optional[np.ndarray]] = {}
+        # HMO filter -> (search parameters, selector) restricting FAISS to matching documents
+        self._filter_params: Dict[str, Tuple[Any, Any]] = {}
         self.load_index()
+        # Micro-batching queue, consumed by a background thread started on first search
+        self._search_queue: "queue.Queue[SearchRequest]" = queue.Queue()
+        self._search_worker = None
+        self._search_worker_lock = threading.Lock()
+        # Normalized query -> unit-length embedding, shared by callers and the batching worker
+        self._query_embeddings: LRUCache = LRUCache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+        self._query_embeddings_lock = threading.Lock()
+        # Reusable query matrices of the batching worker, keyed by batch size
+        self._query_buffers: Dict[int, np.ndarray] = {}
     
     def load_index(self):
         """Load FAISS index and associated data"""
         try:
             # Paths for index, documents, and metadata
             index_path = os.path.join(self.vector_store_path, "faiss_index.bin")
-            docs_path = os.path.join(self.vector_store_path, "documents.pkl")
-            metadata_path = os.path.join(self.vector_store_path, "metadata.pkl")
+            docs_path = os.path.join(self.vector_store_path, "documents.bin")
+            offsets_path = os.path.join(self.vector_store_path, "documents.idx")
+            metadata_path = os.path.join(self.vector_store_path, "metadata.parquet")
+            # Pickled lists written by older versions of build_index.py
+            legacy_docs_path = os.path.join(self.vector_store_path, "documents.pkl")
+            legacy_metadata_path = os.path.join(self.vector_store_path, "metadata.pkl")
             
             # Check if all files exist
-            if all(os.path.exists(p) for p in [index_path, docs_path, metadata_path]):
+            if all(os.path.exists(p) for p in [index_path, docs_path, offsets_path, metadata_path]):
+                # Load FAISS index memory-mapped and read-only, so workers share its pages
+                self.index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                self._move_index_to_gpu()
+                
+                # Map documents and metadata instead of reading them into memory
+                self.documents = MappedDocuments(docs_path, offsets_path)
+                self.metadata = ParquetMetadata(metadata_path)
+                self._hmo_column = self._build_hmo_column(self.metadata.column('hmo'))
+                
+                print(f"Loaded FAISS index with {self.index.ntotal} documents")
+            elif all(os.path.exists(p) for p in [index_path, legacy_docs_path, legacy_metadata_path]):
                 # Load FAISS index
                 self.index = faiss.read_index(index_path)
+                self._move_index_to_gpu()
 
                 # Load documents
-                with open(docs_path, 'rb') as f:
+                with open(legacy_docs_path, 'rb') as f:
                     self.documents = pickle.load(f)
                 
                 # Load metadata
-                with open(metadata_path, 'rb') as f:
+                with open(legacy_metadata_path, 'rb') as f:
                     self.metadata = pickle.load(f)
+                self._hmo_column = self._build_hmo_column([metadata.get('hmo') for metadata in self.metadata])
                     
                 print(f"Loaded FAISS index with {self.index.ntotal} documents")
             else:
@@ -58,6 +145,27 @@ class VectorService:
             self.documents = []
             self.metadata = []
     
+    @staticmethod
+    def _build_hmo_column(hmos: List[Optional[str]]) -> np.ndarray:
+        """Convert per-document HMO values to a lowercase numpy string array ('' when missing)"""
+        return np.array([(hmo or '').lower() for hmo in hmos], dtype=str)
+    
+    def _move_index_to_gpu(self):
+        """Move the loaded index to the first GPU when a GPU build of FAISS can see one"""
+        # faiss-cpu has no GPU support; get_num_gpus may be missing or return 0
+        if getattr(faiss, "get_num_gpus", lambda: 0)() <= 0:
+            return
+        
+        try:
+            # Keep the resources on self so they live as long as the GPU index
+            self.gpu_resources = faiss.StandardGpuResources()
+            self.index = faiss.index_cpu_to_gpu(self.gpu_resources, 0, self.index)
+            print("Moved FAISS index to GPU")
+        except Exception as e:
+            # Not every index type has a GPU implementation (e.g. HNSW) - keep searching on CPU
+            print(f"Keeping FAISS index on CPU: {e}")
+            self.gpu_resources = None
+    
     def search(self, query: str, k: int = 5, hmo_filter: str = "") -> List[RetrievalResult]:
         """Perform similarity search on the FAISS index
         
@@ -74,47 +182,259 @@ class VectorService:
             return []
         
         try:
-            # Get query embedding
-            query_embedding = self.embeddings.embed_query(query)
-            # Convert query embedding to numpy array
-            query_vector = np.array([query_embedding], dtype=np.float32)
+            query = self._normalize_query(query)
+            cached_results = self._search_cached(query, k, hmo_filter)
+            if cached_results is not None:
+                return cached_results
+            return self._submit_search(query, k, hmo_filter).result()
+        except Exception as e:
+            print(f"Error during search: {e}")
+            return []
+    
+    async def asearch(self, query: str, k: int = 5, hmo_filter: str = "") -> List[RetrievalResult]:
+        """Perform similarity search on the FAISS index without blocking the event loop
+        
+        Args:
+            query: The query to search with
+            k: The number of results to return
+            hmo_filter: Optional HMO name to filter results by
+        
+        Returns:
+            List[RetrievalResult]: List of retrieval results
+        """
+        # Check if index is loaded
+        if self.index is None:
+            return []
+        
+        try:
+            query = self._normalize_query(query)
+            cached_results = self._search_cached(query, k, hmo_filter)
+            if cached_results is not None:
+                return cached_results
+            return await asyncio.wrap_future(self._submit_search(query, k, hmo_filter))
+        except Exception as e:
+            print(f"Error during search: {e}")
+            return []
+    
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Lowercase and collapse whitespace so trivial variations share an embedding"""
+        return " ".join(query.lower().split())
+    
+    def _search_cached(self, query: str, k: int, hmo_filter: str) -> Optional[List[RetrievalResult]]:
+        """Search right away if the query's embedding is cached, skipping the batching queue
+        
+        Args:
+            query: The normalized query
+            k: The number of results to return
+            hmo_filter: Optional HMO name to filter results by
+        
+        Returns:
+            Optional[List[RetrievalResult]]: Retrieval results, or None on a cache miss
+        """
+        with self._query_embeddings_lock:
+            query_vector = self._query_embeddings.get(query)
+        if query_vector is None:
+            return None
+        return self._search_vectors(query_vector[np.newaxis, :], [(k, hmo_filter)])[0]
+    
+    def _submit_search(self, query: str, k: int, hmo_filter: str) -> Future:
+        """Queue a search for the micro-batching worker and return its future"""
+        if self._search_worker is None:
+            with self._search_worker_lock:
+                if self._search_worker is None:
+                    self._search_worker = threading.Thread(target=self._search_loop, daemon=True)
+                    self._search_worker.start()
+        
+        future: Future = Future()
+        self._search_queue.put((query, k, hmo_filter, future))
+        return future
+    
+    def _search_loop(self):
+        """Collect queued searches into batches and run each batch with one embedding call"""
+        while True:
+            # Wait for a search, then gather more until the batch is full or the window closes
+            batch = [self._search_queue.get()]
+            deadline = time.monotonic() + SEARCH_BATCH_WINDOW
+            while len(batch) < SEARCH_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._search_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
             
-            # Search in FAISS
-            scores, indexes = self.index.search(query_vector, min(k, self.index.ntotal))
+            try:
+                batch_results = self._search_batch(batch)
+            except Exception as e:
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+                continue
             
-            results = []
-            # Iterate over retrieved scores and indexes
-            for score, idx in zip(scores[0], indexes[0]):
-                
-                # Get document and metadata
-                doc = self.documents[idx] # type: ignore
-                metadata = self.metadata[idx] # type: ignore
-                
-                # Apply HMO filter if provided
-                if hmo_filter:
-                    # Check if the document's HMO matches the filter
-                    doc_hmo = metadata.get('hmo', '').lower()
-                    filter_hmo = hmo_filter.lower()
-                    
-                    # Skip if HMO doesn't match (allow partial matches)
-                    if filter_hmo not in doc_hmo and doc_hmo not in filter_hmo:
-                        continue
-                
-                # Add retrieval result
-                results.append(RetrievalResult(
-                    content=doc,
-                    metadata=metadata,
-                    score=float(score) # Cosine similarity score
-                ))
-                
-                if len(results) >= k:
-                    break
+            for (_, _, _, future), results in zip(batch, batch_results):
+                future.set_result(results)
+    
+    def _search_batch(self, batch: List[SearchRequest]) -> List[List[RetrievalResult]]:
+        """Embed and search a batch of queries together
+        
+        Args:
+            batch: Queued search requests
+        
+        Returns:
+            List[List[RetrievalResult]]: Retrieval results of each request, in batch order
+        """
+        # Embed all queries with a single request, written into a reused C-contiguous float32 buffer
+        queries = [query for query, _, _, _ in batch]
+        query_vectors = self._query_buffers.get(len(batch))
+        if query_vectors is None:
+            query_vectors = np.empty((len(batch), self.index.d), dtype=np.float32)
+            self._query_buffers[len(batch)] = query_vectors
+        query_vectors[:] = self.embeddings.embed_documents(queries)
+        faiss.normalize_L2(query_vectors)
+        
+        with self._query_embeddings_lock:
+            for query, query_vector in zip(queries, query_vectors):
+                # Copy out of the buffer, which is overwritten by the next batch
+                self._query_embeddings[query] = query_vector.copy()
+        
+        return self._search_vectors(query_vectors, [(k, hmo_filter) for _, k, hmo_filter, _ in batch])
+    
+    def _search_vectors(self, query_vectors: np.ndarray, searches: List[Tuple[int, str]]) -> List[List[RetrievalResult]]:
+        """Search the index with normalized query embeddings
+        
+        Args:
+            query_vectors: Query embeddings, one row per search
+            searches: (k, hmo_filter) of each search
+        
+        Returns:
+            List[List[RetrievalResult]]: Retrieval results of each search, in order
+        """
+        # Group queries by HMO filter, since each FAISS call takes a single ID selector
+        rows_by_filter = defaultdict(list)
+        for row, (_, hmo_filter) in enumerate(searches):
+            rows_by_filter[hmo_filter.lower()].append(row)
+        
+        batch_results: List[List[RetrievalResult]] = [[] for _ in searches]
+        for hmo_filter, rows in rows_by_filter.items():
+            # No filter, or one that keeps every document, searches the whole index without a selector
+            mask = self._get_hmo_mask(hmo_filter) if hmo_filter else None
+            params = None
+            if mask is not None:
+                # No document matches this HMO
+                if not mask.any():
+                    continue
+                if self.gpu_resources is not None:
+                    self._search_vectors_post_filtered(query_vectors, searches, rows, hmo_filter, batch_results)
+                    continue
+                params = self._get_search_params(hmo_filter)
             
-            return results
+            # Search in FAISS once per filter group, with the largest k requested
+            max_k = min(max(searches[row][0] for row in rows), self.index.ntotal)
+            scores, indexes = self.index.search(query_vectors[rows], max_k, params=params)
             
-        except Exception as e:
-            print(f"Error during search: {e}")
-            return []
+            for i, row in enumerate(rows):
+                batch_results[row] = self._build_results(scores[i], indexes[i], searches[row][0])
+        
+        return batch_results
+    
+    def _search_vectors_post_filtered(self, query_vectors: np.ndarray, searches: List[Tuple[int, str]],
+                                      rows: List[int], hmo_filter: str, batch_results: List[List[RetrievalResult]]):
+        """Search a GPU index without an ID selector and keep only the hits of an HMO
+        
+        Args:
+            query_vectors: Query embeddings, one row per search
+            searches: (k, hmo_filter) of each search
+            rows: Rows of the searches sharing this filter
+            hmo_filter: Canonical HMO name to filter by (matching some, but not all, documents)
+            batch_results: Retrieval results of each search, filled in for the given rows
+        """
+        mask = self._get_hmo_mask(hmo_filter)
+        matching = int(mask.sum())
+        
+        # Over-fetch in proportion to how rare the HMO's documents are
+        max_k = max(searches[row][0] for row in rows)
+        oversampling = GPU_FILTER_OVERSAMPLING * -(-len(mask) // matching)
+        search_k = min(max_k * oversampling, GPU_MAX_K, self.index.ntotal)
+        scores, indexes = self.index.search(query_vectors[rows], search_k)
+        
+        # Drop padding and other HMOs' documents
+        keep = (indexes >= 0) & mask[np.maximum(indexes, 0)]
+        for i, row in enumerate(rows):
+            batch_results[row] = self._build_results(scores[i][keep[i]], indexes[i][keep[i]], searches[row][0])
+    
+    def _get_hmo_mask(self, hmo_filter: str) -> Optional[np.ndarray]:
+        """Get (and cache) the boolean mask of the documents matching an HMO filter
+        
+        Args:
+            hmo_filter: Canonical HMO name to filter by (see services.hmo)
+        
+        Returns:
+            Optional[np.ndarray]: True for the HMO's documents and the general documents (tagged ""),
+            or None if that is every document (e.g. an index built without HMO tags)
+        """
+        if hmo_filter not in self._hmo_masks:
+            mask = (self._hmo_column == hmo_filter) | (self._hmo_column == '')
+            self._hmo_masks[hmo_filter] = None if mask.all() else mask
+        return self._hmo_masks[hmo_filter]
+    
+    def _get_search_params(self, hmo_filter: str) -> Any:
+        """Build (and cache) FAISS search parameters that only visit documents of an HMO
+        
+        Args:
+            hmo_filter: Canonical HMO name to filter by (matching some, but not all, documents)
+        
+        Returns:
+            Any: Search parameters with an ID selector
+        """
+        if hmo_filter not in self._filter_params:
+            ids = np.flatnonzero(self._get_hmo_mask(hmo_filter)).astype(np.int64)
+            selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+            # Explicit parameters replace the index's own efSearch / nprobe
+            if isinstance(self.index, faiss.IndexHNSW):
+                params = faiss.SearchParametersHNSW()
+                params.efSearch = self.index.hnsw.efSearch
+            elif isinstance(self.index, faiss.IndexIVF):
+                params = faiss.SearchParametersIVF()
+                params.nprobe = self.index.nprobe
+            else:
+                params = faiss.SearchParameters()
+            params.sel = selector
+            # The parameters only hold a pointer to the selector, so keep both alive
+            self._filter_params[hmo_filter] = (params, selector)
+        
+        return self._filter_params[hmo_filter][0]
+    
+    def _build_results(self, scores: np.ndarray, indexes: np.ndarray, k: int) -> List[RetrievalResult]:
+        """Convert one query's FAISS hits to retrieval results
+        
+        Args:
+            scores: Similarity scores of the hits
+            indexes: Document indexes of the hits
+            k: The number of results to return
+        
+        Returns:
+            List[RetrievalResult]: List of retrieval results
+        """
+        results = []
+        # Approximate indexes pad missing hits with -1; drop them before building any objects
+        scores, indexes = scores[:k], indexes[:k]
+        hits = indexes >= 0
+        
+        # Iterate over retrieved scores and indexes
+        for score, idx in zip(scores[hits], indexes[hits]):
+            # Get document and metadata
+            doc = self.documents[idx] # type: ignore
+            metadata = self.metadata[idx] # type: ignore
+            
+            # Add retrieval result
+            results.append(RetrievalResult(
+                content=doc,
+                metadata=metadata,
+                score=float(score) # Cosine similarity score
+            ))
+        
+        return results
     
     def get_stats(self) -> Dict[str, Any]:
         """Get vector store statistics
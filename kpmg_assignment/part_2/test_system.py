@@ -3,24 +3,58 @@
 System testing script for Medical Services ChatBot
 """
 
+import os
 import httpx
 import asyncio
 import json
+import orjson
+import math
 import time
-from typing import Dict, Any
+import uuid
+import logging
+from typing import Dict, Any, List, Optional, Tuple
 
 API_BASE_URL = "http://localhost:8000"
 
+# Per-step conversation details are logged at DEBUG (run with LOG_LEVEL=DEBUG to see them)
+log = logging.getLogger("sys_test")
+
+# Optional pause between onboarding messages, e.g. when the LLM deployment is rate-limited
+STEP_DELAY = float(os.getenv("TEST_STEP_DELAY", "0"))
+
+# Fixed timestamp of the chat history messages sent by the tests
+TS = "2024-01-01T00:00:00"
+
+# Number of concurrent onboarding sessions in the load test (0 skips it)
+CONCURRENT_SESSIONS = int(os.getenv("CONCURRENT_SESSIONS", "0"))
+
+# Send a session ID instead of the conversation history (the API must run with REDIS_URL set)
+USE_SESSIONS = os.getenv("TEST_SESSIONS") == "1"
+
 class SystemTester:
     def __init__(self):
-        self.client = httpx.AsyncClient(timeout=30.0)
+        # One pooled client for all tests: keep-alive connections, HTTP/2 where the server offers it
+        self.client = httpx.AsyncClient(
+            base_url=API_BASE_URL,
+            timeout=30.0,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=30.0)
+        )
+    
+    async def _post_chat(self, request_data: Dict[str, Any]) -> httpx.Response:
+        """POST a chat request, with the body pre-encoded by orjson"""
+        return await self.client.post(
+            "/chat",
+            content=orjson.dumps(request_data),
+            headers={"content-type": "application/json"}
+        )
     
     async def test_api_health(self) -> bool:
         """Test API health endpoint"""
         print("🔍 Testing API health...")
         try:
-            response = await self.client.get(f"{API_BASE_URL}/")
-            if response.status_code == 200:
+            response = await self.client.get("/")
+            if response.is_success:
                 print("✅ API is healthy")
                 return True
             else:
@@ -34,9 +68,9 @@ class SystemTester:
         """Test vector store status"""
         print("🔍 Testing vector store...")
         try:
-            response = await self.client.get(f"{API_BASE_URL}/vector-store/stats")
-            if response.status_code == 200:
-                stats = response.json()
+            response = await self.client.get("/vector-store/stats")
+            if response.is_success:
+                stats = orjson.loads(response.content)
                 if stats["status"] == "loaded":
                     print(f"✅ Vector store loaded with {stats['total_documents']} documents")
                     return True
@@ -54,9 +88,9 @@ class SystemTester:
         """Test welcome message endpoint"""
         print("🔍 Testing welcome message...")
         try:
-            response = await self.client.get(f"{API_BASE_URL}/welcome")
-            if response.status_code == 200:
-                message = response.json()["message"]
+            response = await self.client.get("/welcome")
+            if response.is_success:
+                message = orjson.loads(response.content)["message"]
                 if message and len(message) > 10:
                     print("✅ Welcome message retrieved successfully")
                     return True
@@ -81,13 +115,10 @@ class SystemTester:
                 "phase": "onboarding"
             }
             
-            response = await self.client.post(
-                f"{API_BASE_URL}/chat",
-                json=request_data
-            )
+            response = await self._post_chat(request_data)
             
-            if response.status_code == 200:
-                result = response.json()
+            if response.is_success:
+                result = orjson.loads(response.content)
                 if result["message"] and result["phase"] == "onboarding":
                     print("✅ Onboarding chat works")
                     print(f"   Response: {result['message'][:100]}...")
@@ -107,93 +138,144 @@ class SystemTester:
             print(f"❌ Onboarding chat error: {e}")
             return False
     
-    async def test_full_onboarding_flow(self) -> Dict[str, Any]:
-        """Test complete onboarding flow with long-running LLM session"""
-        print("🔍 Testing full onboarding flow...")
-        
-        conversation_history = []
-        user_profile = None
-        phase = "onboarding"
-        
+    @staticmethod
+    def _onboarding_messages(uid: int = 0) -> List[str]:
+        """Onboarding messages of a synthetic user (uid 0 is the original test user)"""
         # Test messages in sequence for long-running LLM collection
-        test_messages = [
+        return [
             "שלום, שמי דן כהן",  # Should start collecting info
-            "מספר הזהות שלי הוא 123456789",  # Should acknowledge and ask for more
+            f"מספר הזהות שלי הוא {123456789 + uid:09d}",  # Should acknowledge and ask for more
             "אני זכר",  # Should acknowledge and ask for more
-            "נולדתי ב-15/05/1985",  # Should acknowledge and ask for more
+            f"נולדתי ב-{uid % 28 + 1:02d}/05/1985",  # Should acknowledge and ask for more
             "אני חבר במכבי",  # Should acknowledge and ask for more
             "יש לי חבילת זהב",  # Should complete collection and transition to Q&A
         ]
+    
+    async def _one_onboarding(self, uid: int = 0) -> Tuple[Optional[Dict[str, Any]], str, float]:
+        """Run one onboarding conversation until it reaches the Q&A phase
         
-        try:
-            for i, message in enumerate(test_messages):
-                print(f"   Step {i+1}: {message}")
-                
-                request_data = {
-                    "message": message,
-                    "user_profile": user_profile,
-                    "conversation_history": conversation_history,
-                    "phase": phase
-                }
-                
-                response = await self.client.post(
-                    f"{API_BASE_URL}/chat",
-                    json=request_data
-                )
-                
-                if response.status_code != 200:
-                    print(f"❌ Step {i+1} failed: {response.status_code}")
-                    return {}
-                
-                result = response.json()
-                
-                # Update state
-                conversation_history.append({"role": "user", "content": message, "timestamp": "2024-01-01T00:00:00"})
-                conversation_history.append({"role": "assistant", "content": result["message"], "timestamp": "2024-01-01T00:00:00"})
-                
-                if result.get("user_profile"):
-                    user_profile = result["user_profile"]
-                
-                phase = result["phase"]
-                
-                print(f"      Bot: {result['message'][:80]}...")
-                print(f"      Phase: {phase}")
-                
-                # If we reached Q&A phase, break
-                if phase == "qa":
-                    print("✅ Successfully completed onboarding!")
-                    return user_profile
-                    
-                # Small delay between messages
-                await asyncio.sleep(0.5)
+        Args:
+            uid: Synthetic user number, used to give each session a distinct ID number and birth date
+        
+        Returns:
+            Tuple[Optional[Dict[str, Any]], str, float]: The collected user profile, the final phase and the
+            session's duration in seconds
+        """
+        conversation_history = []
+        user_profile = None
+        phase = "onboarding"
+        session_id = uuid.uuid4().hex
+        start_time = time.perf_counter()
+        
+        for i, message in enumerate(self._onboarding_messages(uid)):
+            log.debug("   [%d] Step %d: %s", uid, i + 1, message)
             
-            # If we finished all messages but didn't reach Q&A phase, try one more completion message
-            if phase != "qa":
-                print("   Trying completion message...")
-                request_data = {
-                    "message": "זה הכל, יש לכם את כל המידע שלי",
-                    "user_profile": user_profile,
-                    "conversation_history": conversation_history,
-                    "phase": phase
-                }
-                
-                response = await self.client.post(f"{API_BASE_URL}/chat", json=request_data)
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("user_profile"):
-                        user_profile = result["user_profile"]
-                    if result["phase"] == "qa":
-                        print("✅ Successfully completed onboarding with completion message!")
-                        return user_profile
+            request_data = {
+                "message": message,
+                "user_profile": user_profile,
+                "conversation_history": conversation_history,
+                "phase": phase
+            }
+            if USE_SESSIONS:
+                # The server keeps the history; only the new message is sent
+                request_data["session_id"] = session_id
+                request_data["conversation_history"] = []
+            
+            response = await self._post_chat(request_data)
+            
+            if not response.is_success:
+                raise RuntimeError(f"Step {i+1} failed: {response.status_code}")
+            
+            result = orjson.loads(response.content)
+            
+            # Update state
+            conversation_history.extend((
+                {"role": "user", "content": message, "timestamp": TS},
+                {"role": "assistant", "content": result["message"], "timestamp": TS}
+            ))
+            
+            if result.get("user_profile"):
+                user_profile = result["user_profile"]
             
-            if phase != "qa":
-                print("❌ Onboarding did not complete to Q&A phase")
+            phase = result["phase"]
             
-            return user_profile or {}
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("      Bot: %s...", result["message"][:80])
+                log.debug("      Phase: %s", phase)
             
+            # If we reached Q&A phase, stop
+            if phase == "qa":
+                return user_profile, phase, time.perf_counter() - start_time
+                
+            # Optional delay between messages
+            if STEP_DELAY > 0:
+                await asyncio.sleep(STEP_DELAY)
+        
+        # If we finished all messages but didn't reach Q&A phase, try one more completion message
+        log.debug("   [%d] Trying completion message...", uid)
+        request_data = {
+            "message": "זה הכל, יש לכם את כל המידע שלי",
+            "user_profile": user_profile,
+            "conversation_history": conversation_history,
+            "phase": phase
+        }
+        if USE_SESSIONS:
+            request_data["session_id"] = session_id
+            request_data["conversation_history"] = []
+        
+        response = await self._post_chat(request_data)
+        if response.is_success:
+            result = orjson.loads(response.content)
+            if result.get("user_profile"):
+                user_profile = result["user_profile"]
+            phase = result["phase"]
+        
+        return user_profile, phase, time.perf_counter() - start_time
+    
+    async def test_full_onboarding_flow(self) -> Dict[str, Any]:
+        """Test complete onboarding flow with long-running LLM session"""
+        print("🔍 Testing full onboarding flow...")
+        
+        try:
+            user_profile, phase, _ = await self._one_onboarding()
         except Exception as e:
             print(f"❌ Full onboarding test error: {e}")
             return {}
+        
+        if phase == "qa":
+            print("✅ Successfully completed onboarding!")
+        else:
+            print("❌ Onboarding did not complete to Q&A phase")
+        
+        return user_profile or {}
+    
+    async def test_concurrent_onboarding(self, n: int = 20) -> bool:
+        """Run n onboarding sessions concurrently and report session latency percentiles"""
+        print(f"🔍 Testing {n} concurrent onboarding sessions...")
+        
+        outcomes = await asyncio.gather(*(self._one_onboarding(uid) for uid in range(n)), return_exceptions=True)
+        
+        latencies = []
+        for uid, outcome in enumerate(outcomes):
+            if isinstance(outcome, BaseException):
+                print(f"   Session {uid} error: {outcome}")
+            elif outcome[1] != "qa":
+                print(f"   Session {uid} did not complete to Q&A phase")
+            else:
+                latencies.append(outcome[2])
+        
+        if latencies:
+            # Nearest-rank percentiles
+            latencies.sort()
+            p50 = latencies[math.ceil(0.50 * len(latencies)) - 1]
+            p99 = latencies[math.ceil(0.99 * len(latencies)) - 1]
+            print(f"   Session latency p50: {p50:.2f}s, p99: {p99:.2f}s")
+        
+        if len(latencies) == n:
+            print(f"✅ All {n} concurrent sessions completed onboarding")
+            return True
+        print(f"❌ {n - len(latencies)}/{n} concurrent sessions failed")
+        return False
     
     async def test_qa_chat(self, user_profile: Dict[str, Any]) -> bool:
         """Test Q&A conversation"""
@@ -207,18 +289,15 @@ class SystemTester:
                 "message": "איזה בדיקות אני זכאי בחבילת הזהב של מכבי?",
                 "user_profile": user_profile,
                 "conversation_history": [
-                    {"role": "assistant", "content": "המידע שלך נשמר. מה תרצה לדעת?", "timestamp": "2024-01-01T00:00:00"}
+                    {"role": "assistant", "content": "המידע שלך נשמר. מה תרצה לדעת?", "timestamp": TS}
                 ],
                 "phase": "qa"
             }
             
-            response = await self.client.post(
-                f"{API_BASE_URL}/chat",
-                json=request_data
-            )
+            response = await self._post_chat(request_data)
             
-            if response.status_code == 200:
-                result = response.json()
+            if response.is_success:
+                result = orjson.loads(response.content)
                 if result["message"] and result["phase"] == "qa":
                     print("✅ Q&A chat works")
                     print(f"   Response: {result['message'][:100]}...")
@@ -240,7 +319,7 @@ class SystemTester:
         
         start_time = time.time()
         
-        # Test sequence
+        # Independent pre-flight checks, run concurrently
         tests = [
             ("API Health", self.test_api_health()),
             ("Vector Store", self.test_vector_store()),
@@ -248,15 +327,19 @@ class SystemTester:
             ("Basic Onboarding", self.test_onboarding_chat()),
         ]
         
+        print(f"\n{'='*20} Pre-flight Checks {'='*20}")
+        outcomes = await asyncio.gather(*(test_coro for _, test_coro in tests), return_exceptions=True)
+        
         results = []
-        for test_name, test_coro in tests:
-            print(f"\n{'='*20} {test_name} {'='*20}")
-            result = await test_coro
-            results.append(result)
+        for (test_name, _), outcome in zip(tests, outcomes):
+            # An unexpected exception counts as a failure without cancelling the other checks
+            if isinstance(outcome, BaseException):
+                print(f"❌ {test_name} error: {outcome}")
+                outcome = False
+            results.append(outcome)
             
-            if not result:
-                print(f"❌ {test_name} failed - stopping tests")
-                break
+            if not outcome:
+                print(f"❌ {test_name} failed")
         
         # Run full onboarding flow if basic tests pass
         if all(results):
@@ -267,6 +350,12 @@ class SystemTester:
                 print(f"\n{'='*20} Q&A Testing {'='*20}")
                 qa_result = await self.test_qa_chat(user_profile)
                 results.append(qa_result)
+            
+            if CONCURRENT_SESSIONS > 0:
+                print(f"\n{'='*20} Concurrent Onboarding {'='*20}")
+                results.append(await self.test_concurrent_onboarding(CONCURRENT_SESSIONS))
+        else:
+            print("❌ Pre-flight checks failed - stopping tests")
         
         # Summary
         print("\n" + "="*60)
@@ -302,5 +391,6 @@ async def main():
         await tester.close()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(message)s")
     exit_code = asyncio.run(main())
     exit(exit_code)
\ No newline at end of file
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+HMO filtering tests for the vector service, run on an index that build_index.py builds from
+phase2_data with fake embeddings (no Azure OpenAI calls)
+"""
+
+import os
+import sys
+import hashlib
+import tempfile
+from collections import Counter
+import numpy as np
+import faiss
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+
+import build_index
+import services.vector_service as vector_service_module
+from services.vector_service import VectorService
+from services.agent_tools import create_search_info_tool
+from services.hmo import normalize_hmo
+
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "phase2_data")
+DIMENSION = 256
+QUESTION = "בדיקות וניקוי שיניים זהב"
+
+# Heading suffix of each HMO's sections, as written by build_index.py ("<page heading> - <HMO>")
+SECTION_HEADINGS = {"maccabi": " - מכבי", "meuhedet": " - מאוחדת", "clalit": " - כללית"}
+
+class FakeEmbeddings:
+    """Deterministic bag-of-words embeddings: texts sharing words get similar vectors"""
+    @staticmethod
+    def _embed(text: str) -> list:
+        vector = np.zeros(DIMENSION, dtype=np.float32)
+        for word in text.lower().split():
+            digest = hashlib.blake2b(word.encode('utf-8'), digest_size=4).digest()
+            vector[int.from_bytes(digest, 'little') % DIMENSION] += 1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
+
+def build_test_service(path: str) -> VectorService:
+    """Build the knowledge base index with build_index.py and load it with fake embeddings"""
+    build_index.create_embeddings = lambda **kwargs: FakeEmbeddings()
+    vector_service_module.get_embeddings = FakeEmbeddings
+    build_index.IndexBuilder(data_folder=DATA_FOLDER, vector_store_path=path).build_index()
+    return VectorService(path)
+
+def other_hmo_headings(hmo: str) -> list:
+    """Section headings of every HMO except the given one"""
+    return [heading for other, heading in SECTION_HEADINGS.items() if other != hmo]
+
+def test_builder_tags_hmo(service: VectorService) -> bool:
+    """Every page is split into general chunks and chunks tagged with one canonical HMO"""
+    counts = Counter(service.metadata.column('hmo'))
+    if set(counts) != {"", "maccabi", "meuhedet", "clalit"}:
+        print(f"❌ Chunk HMO tags: {dict(counts)}")
+        return False
+
+    for row, hmo in enumerate(service.metadata.column('hmo')):
+        if hmo and any(heading in service.documents[row] for heading in other_hmo_headings(hmo)):
+            print(f"❌ Chunk {row} tagged {hmo} has another HMO's section")
+            return False
+
+    print(f"✅ Index builder tags chunks by HMO: {dict(counts)}")
+    return True
+
+def test_search_filters_by_hmo(service: VectorService) -> bool:
+    """Filtered searches only return the HMO's chunks and general chunks"""
+    unfiltered = {result.metadata["hmo"] for result in service.search(QUESTION, k=10)}
+    if len(unfiltered - {""}) < 2:
+        print(f"❌ Unfiltered search should return several HMOs, got {unfiltered}")
+        return False
+
+    for name in ("מכבי", "Clalit", "מאוחדת"):
+        hmo = normalize_hmo(name)
+        results = service.search(QUESTION, k=10, hmo_filter=hmo)
+        hmos = {result.metadata["hmo"] for result in results}
+        if hmo not in hmos or not hmos <= {hmo, ""}:
+            print(f"❌ Search filtered by {name} returned chunks of {hmos}")
+            return False
+
+    print("✅ Search filters by HMO")
+    return True
+
+def test_gpu_post_filter(service: VectorService) -> bool:
+    """The GPU path (no ID selector, filtered on CPU) returns the same results as the selector path"""
+    query_vectors = np.array([FakeEmbeddings().embed_query(QUESTION)], dtype=np.float32)
+    faiss.normalize_L2(query_vectors)
+
+    expected = service._search_vectors(query_vectors, [(3, "clalit")])[0]
+    gpu_resources, service.gpu_resources = service.gpu_resources, object()
+    try:
+        post_filtered = service._search_vectors(query_vectors, [(3, "clalit")])[0]
+    finally:
+        service.gpu_resources = gpu_resources
+
+    if [r.content for r in post_filtered] != [r.content for r in expected]:
+        print(f"❌ GPU post-filtered search returned {[r.metadata for r in post_filtered]}")
+        return False
+
+    print("✅ GPU post-filtered search matches the ID selector search")
+    return True
+
+def test_search_tool_uses_hmo(service: VectorService) -> bool:
+    """The search_info tool filters by the HMO as collected in onboarding (in Hebrew)"""
+    search_info = create_search_info_tool(service)
+    result = search_info.invoke({"question": QUESTION, "hmo": "מכבי"})
+
+    if SECTION_HEADINGS["maccabi"] not in result or any(heading in result for heading in other_hmo_headings("maccabi")):
+        print(f"❌ search_info filtered by מכבי returned:\n{result}")
+        return False
+
+    print("✅ search_info restricts the search to the user's HMO")
+    return True
+
+def main() -> int:
+    """Main test function"""
+    with tempfile.TemporaryDirectory() as path:
+        service = build_test_service(path)
+        results = [
+            test_builder_tags_hmo(service),
+            test_search_filters_by_hmo(service),
+            test_gpu_post_filter(service),
+            test_search_tool_uses_hmo(service),
+        ]
+
+    print(f"Passed: {sum(results)}/{len(results)}")
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -3,7 +3,7 @@ import os
 # Add the part_2 directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from langchain.schema import HumanMessage, AIMessage
 from langchain_openai import AzureChatOpenAI
 from models.schemas import UserProfile
@@ -13,19 +13,84 @@ from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.constants import Send
 from services.agent_tools import Tools
+from services.hmo import normalize_hmo
 from dotenv import load_dotenv
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import BaseMessage, SystemMessage, ToolMessage
+from langchain_core.messages import BaseMessage, SystemMessage, ToolMessage, trim_messages
 from typing import Annotated, TypedDict
+import re
 import json
+import hashlib
+from datetime import date, datetime
+from functools import lru_cache
+from diskcache import Cache
 
 # Load environment variables
 load_dotenv()
 
+# Opt-in disk cache of agent LLM responses (LLM_CACHE=1), e.g. for test re-runs and repeated turns
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE") == "1"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "./.llm_cache")
+
+# Most recent conversation messages sent to the agent LLMs on each turn (the extraction tool
+# still reads the full conversation), so prompt size stops growing with the session length
+AGENT_HISTORY_MESSAGES = int(os.getenv("AGENT_HISTORY_MESSAGES", "40"))
+
+# Onboarding fast path (ONBOARDING_FAST_PATH=0 disables it): short answers that give one
+# fixed-format field are acknowledged with a templated question instead of an LLM call
+ONBOARDING_FAST_PATH = os.getenv("ONBOARDING_FAST_PATH", "1") != "0"
+ONBOARDING_FAST_PATH_MAX_LENGTH = 80
+
+# Fixed-format onboarding fields, in the order they are asked for (the name is collected by the LLM first).
+# Each pattern matches one field value; it is anchored to the whole message for the latest answer and
+# to word boundaries when scanning earlier answers, and every match is validated before it is accepted.
+ONBOARDING_EXTRACTORS = {
+    "national_id": r"\d{9}",
+    "gender": r"זכר|נקבה|male|female",
+    "date_of_birth": r"\d{1,2}[/.-]\d{1,2}[/.-]\d{4}",
+    "hmo": r"[בהולמש]?(?:מכבי|כללית|מאוחדת)|maccabi|clalit|meuhedet",
+    "insurance_tier": r"[בהולמש]?(?:זהב|כסף|ארד)|gold|silver|bronze",
+}
+_ONBOARDING_WHOLE_RES = {slot: re.compile(pattern, re.IGNORECASE) for slot, pattern in ONBOARDING_EXTRACTORS.items()}
+_ONBOARDING_WORD_RES = {
+    slot: re.compile(rf"(?<!\w)(?:{pattern})(?!\w)", re.IGNORECASE) for slot, pattern in ONBOARDING_EXTRACTORS.items()
+}
+
+# Words of an assistant question asking for each field (the fast path only handles direct answers)
+ONBOARDING_QUESTION_KEYWORDS = {
+    slot: re.compile(rf"(?<!\w)(?:{pattern})(?!\w)", re.IGNORECASE) for slot, pattern in {
+        "name": r"names?|[הו]?שם|שמך",
+        "national_id": r"ID|[הו]?(?:תעודת|מספר) [ה]?זהות|ת\.?ז",
+        "gender": r"gender|sex|[הו]?מין|[הו]?מגדר",
+        "date_of_birth": r"birth|birthday|[הו]?לידה|[הו]?לידתך",
+        "hmo": r"HMO|health fund|[הו]?קופת חולים|[הו]?קופה",
+        "insurance_tier": r"tier|insurance|plan|[הו]?ביטוח|[הו]?מסלול|[הו]?תוכנית",
+    }.items()
+}
+
+# Valid values of the enumerated fields (Hebrew and English)
+ONBOARDING_GENDERS = {"זכר", "נקבה", "male", "female"}
+ONBOARDING_INSURANCE_TIERS = {"זהב", "כסף", "ארד", "gold", "silver", "bronze"}
+
+# (English, Hebrew) question asking for each fixed-format field
+ONBOARDING_QUESTIONS = {
+    "national_id": ("What is your 9-digit national ID number?", "מהו מספר תעודת הזהות שלך (9 ספרות)?"),
+    "gender": ("What is your gender (male or female)?", "מהו המין שלך (זכר או נקבה)?"),
+    "date_of_birth": ("What is your date of birth (DD/MM/YYYY)?", "מהו תאריך הלידה שלך (DD/MM/YYYY)?"),
+    "hmo": ("Which HMO are you a member of (Clalit, Maccabi or Meuhedet)?", "באיזו קופת חולים את/ה חבר/ה (כללית, מכבי או מאוחדת)?"),
+    "insurance_tier": ("What is your insurance tier (gold, silver or bronze)?", "מהי תוכנית הביטוח שלך (זהב, כסף או ארד)?"),
+}
+
+_HEBREW_RE = re.compile(r"[\u0590-\u05FF]")
+_LATIN_RE = re.compile(r"[A-Za-z]")
+
 # Define the state for the workflow - Updated to include user_profile
 class WorkflowState(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages]
     user_profile: Optional[UserProfile]
+    # "User: ..."/"Assistant: ..." transcript of the first transcript_length messages; with a checkpointer
+    # it is extended on every collector turn, otherwise add_tool_message builds it once per run
+    transcript: str
+    transcript_length: int
 
 class Workflow:
     """
@@ -34,10 +99,20 @@ class Workflow:
     def __init__(self, llm: AzureChatOpenAI, vector_service: VectorService):
         self.llm = llm
         self.vector_service = vector_service
+        # Initialize tools with LLM for extraction tool (shared by the agents and tool nodes)
+        self.tools = Tools(vector_service=vector_service, llm=llm)
+        # Tool-bound LLMs of the agents, bound once and shared by every run
+        self._collector_llm = llm.bind_tools([self.tools.extract_user_info])
+        self._qa_llm = llm.bind_tools([self.tools.search_info])
+        self.llm_cache = Cache(LLM_CACHE_DIR) if LLM_CACHE_ENABLED else None
         self.agents = self.create_agents()
+        # Compiled graph, built on the first build_workflow() call
+        self._compiled = None
 
-    def _load_prompt_from_file(self, filename: str) -> str:
-        """Load prompt content from a file"""
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def _load_prompt_from_file(filename: str) -> str:
+        """Load prompt content from a file (read once per process)"""
         # Get the directory of this script and go up one level to find prompts
         script_dir = os.path.dirname(os.path.abspath(__file__))
         prompts_dir = os.path.join(os.path.dirname(script_dir), "prompts")
@@ -48,33 +123,210 @@ class Workflow:
         except FileNotFoundError:
             raise FileNotFoundError(f"Prompt file not found: {prompt_path}")
 
+    @staticmethod
+    def _llm_cache_key(messages: List[BaseMessage], prompt_content: str, tool_names: List[str]) -> str:
+        """Build a deterministic cache key from the prompt, the conversation and the bound tools"""
+        serialized = json.dumps(
+            [tool_names] + [
+                [msg.type, msg.content, getattr(msg, "tool_calls", None), getattr(msg, "tool_call_id", None)]
+                for msg in messages
+            ],
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.blake2b((serialized + prompt_content).encode("utf-8")).hexdigest()
+
+    async def _cached_invoke(self, llm, messages: List[BaseMessage], prompt_content: str, tool_names: List[str]) -> BaseMessage:
+        """Invoke an agent LLM, reusing the cached response when LLM caching is enabled
+
+        Args:
+            llm: The tool-bound LLM of the agent
+            messages: The messages to send, including the system prompt
+            prompt_content: The agent's system prompt
+            tool_names: Names of the tools bound to the LLM
+
+        Returns:
+            BaseMessage: The LLM response
+        """
+        if self.llm_cache is None:
+            return await llm.ainvoke(messages)
+
+        key = self._llm_cache_key(messages, prompt_content, tool_names)
+        response = self.llm_cache.get(key)
+        if response is None:
+            response = await llm.ainvoke(messages)
+            self.llm_cache.set(key, response)
+        return response
+
+    @staticmethod
+    def _recent_messages(messages: List[BaseMessage]) -> List[BaseMessage]:
+        """Keep the last AGENT_HISTORY_MESSAGES messages, starting at a user turn"""
+        if len(messages) <= AGENT_HISTORY_MESSAGES:
+            return messages
+        return trim_messages(
+            messages,
+            max_tokens=AGENT_HISTORY_MESSAGES,
+            token_counter=len,
+            strategy="last",
+            start_on="human"
+        )
+
+    @staticmethod
+    def _extend_transcript(state: WorkflowState) -> Tuple[str, int]:
+        """Append the messages added since the last update to the state's transcript
+
+        Args:
+            state: The workflow state
+
+        Returns:
+            Tuple[str, int]: The transcript and the number of messages it covers
+        """
+        messages = state["messages"]
+        transcript = state.get("transcript", "")
+        new_lines = [
+            f"{'User' if isinstance(msg, HumanMessage) else 'Assistant'}: {msg.content}"
+            for msg in messages[state.get("transcript_length", 0):]
+            if isinstance(msg, (HumanMessage, AIMessage))
+        ]
+        if new_lines:
+            transcript = "\n".join([transcript, *new_lines] if transcript else new_lines)
+        return transcript, len(messages)
+
+    @staticmethod
+    def _valid_national_id(value: str) -> bool:
+        """Check an Israeli ID number's length and check digit"""
+        if len(value) != 9 or not value.isdigit():
+            return False
+        total = 0
+        for i, digit in enumerate(value):
+            product = int(digit) * (1 + i % 2)
+            total += product - 9 if product > 9 else product
+        return total % 10 == 0
+
+    @staticmethod
+    def _valid_date_of_birth(value: str) -> bool:
+        """Check that a DD/MM/YYYY date (any of / . - as separator) exists and is in the past"""
+        try:
+            born = datetime.strptime(re.sub(r"[.-]", "/", value), "%d/%m/%Y").date()
+        except ValueError:
+            return False
+        return date(1900, 1, 1) <= born <= date.today()
+
+    @classmethod
+    def _valid_onboarding_value(cls, slot: str, value: str) -> bool:
+        """Validate a value matched for a fixed-format onboarding field"""
+        if slot == "national_id":
+            return cls._valid_national_id(value)
+        if slot == "date_of_birth":
+            return cls._valid_date_of_birth(value)
+        if slot == "hmo":
+            return normalize_hmo(value) != ""
+        if slot == "gender":
+            return value.lower() in ONBOARDING_GENDERS
+        # Drop a Hebrew prefix letter (e.g. "בזהב")
+        value = value.lower()
+        return value in ONBOARDING_INSURANCE_TIERS or value[1:] in ONBOARDING_INSURANCE_TIERS
+
+    @classmethod
+    def _fast_path_reply(cls, messages: List[BaseMessage]) -> Optional[str]:
+        """Answer a simple onboarding turn without the LLM
+
+        The reply is templated when the latest user message consists of exactly one valid fixed-format
+        field, given in direct answer to the assistant's question for that field (after the name has been
+        asked for), while another field is still missing. Everything else (the first turn, names, invalid
+        or ambiguous values, questions, corrections and the turn that completes the fields) goes to the LLM.
+
+        Args:
+            messages: The conversation messages
+
+        Returns:
+            Optional[str]: The reply, or None if the LLM should answer
+        """
+        user_messages = [msg.content for msg in messages if msg.type == "human" and isinstance(msg.content, str)]
+        assistant_messages = [msg.content for msg in messages if msg.type == "ai" and isinstance(msg.content, str)]
+        if len(user_messages) < 2 or not assistant_messages or messages[-1].type != "human":
+            return None
+
+        # The whole message must be one valid field value
+        latest = user_messages[-1].strip().rstrip(".!")
+        if len(latest) > ONBOARDING_FAST_PATH_MAX_LENGTH:
+            return None
+        found = [
+            slot for slot, pattern in _ONBOARDING_WHOLE_RES.items()
+            if pattern.fullmatch(latest) and cls._valid_onboarding_value(slot, latest)
+        ]
+        if len(found) != 1:
+            return None
+        slot = found[0]
+
+        # It must answer the assistant's latest question, and the name must have been asked for already
+        if not ONBOARDING_QUESTION_KEYWORDS[slot].search(assistant_messages[-1]):
+            return None
+        if not any(ONBOARDING_QUESTION_KEYWORDS["name"].search(text) for text in assistant_messages[:-1]):
+            return None
+
+        # Fields with a valid value in an earlier answer; giving one again is a correction
+        collected = {
+            other for other, pattern in _ONBOARDING_WORD_RES.items()
+            if any(
+                cls._valid_onboarding_value(other, match.group())
+                for text in user_messages[:-1] for match in pattern.finditer(text)
+            )
+        }
+        if slot in collected:
+            return None
+
+        # Next field to ask for
+        missing = [other for other in ONBOARDING_EXTRACTORS if other not in collected and other != slot]
+        if not missing:
+            return None
+
+        # Answer in Hebrew if the user's latest message with letters is written in Hebrew
+        hebrew = False
+        for text in reversed(user_messages):
+            if _HEBREW_RE.search(text):
+                hebrew = True
+                break
+            if _LATIN_RE.search(text):
+                break
+
+        english_question, hebrew_question = ONBOARDING_QUESTIONS[missing[0]]
+        return f"תודה! {hebrew_question}" if hebrew else f"Thank you! {english_question}"
+
     def create_agents(self):
         """
         Create the agents for the workflow.
         """
-        # Initialize tools with LLM for extraction tool
-        tools = Tools(vector_service=self.vector_service, llm=self.llm)
+        tools = self.tools
 
         # --- Create info collection agent ---
 
         # Load the prompt from the file
         info_collection_prompt_content = self._load_prompt_from_file("info_collection.txt")
         
-        # Create prompt template
-        collector_prompt = ChatPromptTemplate.from_messages([
-            ("system", info_collection_prompt_content),
-            MessagesPlaceholder(variable_name="messages"),
-        ])
+        # System message prepended to every collector turn (built once)
+        self._system_collector = SystemMessage(content=info_collection_prompt_content)
         
         # Create collector agent with extraction tool
-        collector_llm = self.llm.bind_tools([tools.extract_user_info])
+        collector_llm = self._collector_llm
 
         def get_messages_info(messages):
-            return [SystemMessage(content=info_collection_prompt_content)] + messages
-
-        def collector_agent(state):
-            messages = get_messages_info(state["messages"])
-            response = collector_llm.invoke(messages)
+            return [self._system_collector, *self._recent_messages(messages)]
+
+        async def collector_agent(state):
+            # Async so the event loop isn't blocked during generation; tokens are streamed
+            # to astream_events consumers while the full message is returned to the graph
+            reply = None
+            if ONBOARDING_FAST_PATH and state.get("user_profile") is None:
+                reply = self._fast_path_reply(state["messages"])
+            
+            if reply is not None:
+                response = AIMessage(content=reply)
+            else:
+                messages = get_messages_info(state["messages"])
+                response = await self._cached_invoke(
+                    collector_llm, messages, info_collection_prompt_content, [tools.extract_user_info.name]
+                )
             return {"messages": [response]}
 
         # --- Create QA agent ---
@@ -82,15 +334,18 @@ class Workflow:
         # Load the prompt from the file
         qa_prompt_content = self._load_prompt_from_file("qa.txt")
         
+        # System message prepended to every QA turn (built once)
+        self._system_qa = SystemMessage(content=qa_prompt_content)
+        
         # Create QA agent with search tool
-        qa_llm = self.llm.bind_tools([tools.search_info])
+        qa_llm = self._qa_llm
 
         def get_messages_qa(messages):
-            return [SystemMessage(content=qa_prompt_content)] + messages
+            return [self._system_qa, *self._recent_messages(messages)]
 
-        def qa_agent(state):
+        async def qa_agent(state):
             messages = get_messages_qa(state["messages"])
-            response = qa_llm.invoke(messages)
+            response = await self._cached_invoke(qa_llm, messages, qa_prompt_content, [tools.search_info.name])
             return {"messages": [response]}
         
         return {
@@ -98,34 +353,47 @@ class Workflow:
             "qa_agent": qa_agent
         }
 
-    def build_workflow(self):
+    def build_workflow(self, checkpointer=None):
         """
-        Build the workflow of the chatbot.
+        Build the workflow of the chatbot (compiled once per instance when there is no checkpointer).
+
+        Args:
+            checkpointer: Optional LangGraph checkpointer persisting each conversation's state by thread_id
         """
+        if checkpointer is None and self._compiled is not None:
+            return self._compiled
 
         def route_after_collector(state: WorkflowState):
             """Route after collector agent - check if extraction tool was called"""
             last_message = state["messages"][-1]
-            if isinstance(last_message, AIMessage) and hasattr(last_message, 'tool_calls') and last_message.tool_calls:
+            if getattr(last_message, 'tool_calls', None):
                 return "add_tool_message"
-            elif not isinstance(last_message, HumanMessage):
+            if last_message.type != "human":
                 return END
             return "collector_agent"
 
         def route_after_qa(state: WorkflowState):
             """Route after QA agent - check if search tool was called"""
             last_message = state["messages"][-1]
-            if isinstance(last_message, AIMessage) and hasattr(last_message, 'tool_calls') and last_message.tool_calls:
+            if getattr(last_message, 'tool_calls', None):
                 return "handle_qa_tool"
-            elif not isinstance(last_message, HumanMessage):
+            if last_message.type != "human":
                 return END
             return "qa_agent"
 
         # Create the workflow graph
         workflow = StateGraph(WorkflowState)
     
+        collector_agent = self.agents["collector_agent"]
+        if checkpointer is not None:
+            # Persisted conversations serialize only the new turns, so extraction never re-scans the history
+            async def collector_agent(state: WorkflowState, agent=collector_agent):
+                update = await agent(state)
+                update["transcript"], update["transcript_length"] = self._extend_transcript(state)
+                return update
+        
         # Add nodes
-        workflow.add_node("collector_agent", self.agents["collector_agent"])
+        workflow.add_node("collector_agent", collector_agent)
         workflow.add_node("qa_agent", self.agents["qa_agent"])
         
         # Add the tool message handler node for collector
@@ -136,21 +404,16 @@ class Workflow:
             tool_call = last_message.tool_calls[0]
             
             # Execute the tool to get the result
-            tools = Tools(vector_service=self.vector_service, llm=self.llm)
+            tools = self.tools
             try:
-                # Format the conversation history for the tool
-                conversation_text = "\n".join([
-                    f"{'User' if isinstance(msg, HumanMessage) else 'Assistant'}: {msg.content}"
-                    for msg in state["messages"] 
-                    if isinstance(msg, (HumanMessage, AIMessage)) and hasattr(msg, 'content')
-                ])
+                # Format the conversation history for the tool (only the new messages with a checkpointer)
+                conversation_text, _ = self._extend_transcript(state)
                 
                 # Call the extraction tool
                 extraction_result = tools.extract_user_info.invoke({"conversation_history": conversation_text})
                 
-                # Parse the result to create UserProfile
-                user_profile_data = json.loads(extraction_result)
-                user_profile = UserProfile(**user_profile_data)
+                # Parse the JSON result straight into a UserProfile
+                user_profile = UserProfile.model_validate_json(extraction_result)
                 
                 tool_result = "User information collected successfully! How can I help you with HMO services?"
                 
@@ -177,13 +440,15 @@ class Workflow:
             tool_call = last_message.tool_calls[0]
             
             # Execute the search tool
-            tools = Tools(vector_service=self.vector_service, llm=self.llm)
+            tools = self.tools
             try:
                 # Get the question from the tool call
                 question = tool_call["args"]["question"]
                 
-                # Call the search tool
-                search_result = tools.search_info.invoke({"question": question})
+                # Call the search tool, restricted to the user's HMO
+                user_profile = state.get("user_profile")
+                hmo = user_profile.hmo if user_profile is not None else ""
+                search_result = tools.search_info.invoke({"question": question, "hmo": hmo})
                 
                 tool_result = search_result
                 
@@ -224,26 +489,29 @@ class Workflow:
         workflow.add_edge("handle_qa_tool", "qa_agent")
         
         # Compile and return the workflow
-        return workflow.compile()
+        compiled = workflow.compile(checkpointer=checkpointer)
+        if checkpointer is None:
+            self._compiled = compiled
+        return compiled
     
 if __name__ == "__main__":
 
     # --- Functions to Print Chatbot Flow ---
 
+    import asyncio
     from langchain_core.messages import convert_to_messages
 
 
-    def pretty_print_message(message, indent=False):
+    def format_message(message, indent=False):
         pretty_message = message.pretty_repr(html=True)
         if not indent:
-            print(pretty_message)
-            return
+            return pretty_message
 
-        indented = "\n".join("\t" + c for c in pretty_message.split("\n"))
-        print(indented)
+        return "\n".join("\t" + c for c in pretty_message.split("\n"))
 
 
     def pretty_print_messages(update, last_message=False):
+        # Collect the whole update and write it to stdout once, instead of many small prints
         is_subgraph = False
         if isinstance(update, tuple):
             ns, update = update
@@ -252,25 +520,26 @@ if __name__ == "__main__":
                 return
 
             graph_id = ns[-1].split(":")[0]
-            print(f"Update from subgraph {graph_id}:")
-            print("\n")
+            output = [f"Update from subgraph {graph_id}:", "\n"]
             is_subgraph = True
+        else:
+            output = []
 
         for node_name, node_update in update.items():
             update_label = f"Update from node {node_name}:"
             if is_subgraph:
                 update_label = "\t" + update_label
 
-            print(update_label)
-            print("\n")
+            output.extend([update_label, "\n"])
 
             messages = convert_to_messages(node_update["messages"])
             if last_message:
                 messages = messages[-1:]
 
-            for m in messages:
-                pretty_print_message(m, indent=is_subgraph)
-            print("\n")
+            output.extend(format_message(m, indent=is_subgraph) for m in messages)
+            output.append("\n")
+
+        print("\n".join(output))
     
     # Load environment variables
     load_dotenv()
@@ -316,10 +585,10 @@ if __name__ == "__main__":
         # Add user message to conversation history
         conversation_messages.append(HumanMessage(content=user_input))
 
-        # Run the multi-agent bot with full conversation history
-        try:
+        # Run the multi-agent bot with full conversation history (the agents are async)
+        async def run_turn():
             final_state = None
-            for chunk in compiled_workflow.stream(
+            async for chunk in compiled_workflow.astream(
                 {
                     "messages": conversation_messages,  # Pass full history
                     "user_profile": None  # Initialize user_profile
@@ -329,6 +598,10 @@ if __name__ == "__main__":
                 pretty_print_messages(chunk, last_message=True)
                 # Keep track of the final state
                 final_state = chunk
+            return final_state
+
+        try:
+            final_state = asyncio.run(run_turn())
             
             # Update conversation history with agent responses
             if final_state: